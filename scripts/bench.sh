@@ -0,0 +1 @@
+SDL_VIDEODRIVER=dummy ./venv/bin/python src/bench.py "$@"
@@ -0,0 +1,222 @@
+import os
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import argparse
+import json
+import platform
+import subprocess
+from random import Random
+from statistics import median
+from time import perf_counter
+
+import pygame as pg
+
+from toolshed import get_logger
+from toolshed.atlas import AtlasManager
+from toolshed.font import FontSpriteWriter, Dialogue
+from toolshed.particles import ParticleManager
+from toolshed.spatial import SpatialHash
+from toolshed.ui import UI, RectNode
+from toolshed.window import PygameContext
+
+from main import Grid, Camera, Player, Item, Obstacle, grid_index_to_coords_centered
+from utils import *
+
+logger = get_logger()
+
+# run from the repository root: ./scripts/bench.sh [--only camera ui] [--out new.json] [--compare old.json]
+
+def time_calls(fn, n): 
+    start = perf_counter()
+    for _ in range(n): 
+        fn()
+    return perf_counter() - start
+
+def measure(fn, min_time=0.2, repeat=5) -> dict: 
+    # grow the call count until one repeat takes a fair share of min_time, then keep the best and median
+    n = 1
+    while time_calls(fn, n) < min_time / repeat: 
+        n *= 2
+    times = [time_calls(fn, n) / n for _ in range(repeat)]
+    return {
+        'calls': n,
+        'best_us': round(min(times) * 1e6, 3),
+        'median_us': round(median(times) * 1e6, 3),
+    }
+
+def bench_font(results, rng: Random): 
+    sheet = pg.image.load('assets/font-bold.png').convert_alpha()
+    fsr = FontSpriteWriter(sheet, 9, 9)
+    surf = pg.Surface((WIDTH, HEIGHT))
+    words = ['snow', 'ball', 'effect', 'tree', 'a', 'melting', 'spring', 'carrot']
+
+    for length in (16, 64, 256): 
+        text = ''
+        while len(text) < length: 
+            text += rng.choice(words) + ' '
+        text = text[:length]
+
+        # one long line versus wrapping inside a narrow box
+        for wrap, w in (('line', length * fsr.sprite_w), ('wrap', WIDTH // 2)): 
+            rows = -(-length * fsr.sprite_w // w) * 2
+            dialogue = Dialogue(text, pg.Rect(0, 0, w, rows * fsr.sprite_h))
+
+            results[f'font.render/len={length}/{wrap}/cached'] = measure(lambda: fsr.render(surf, dialogue, (3, 0, 158)))
+
+            def uncached(): 
+                fsr.clear_cache()
+                fsr.render(surf, dialogue, (3, 0, 158))
+            results[f'font.render/len={length}/{wrap}/uncached'] = measure(uncached)
+
+def bench_particles(results, rng: Random): 
+    surf = pg.Surface((WIDTH, HEIGHT))
+    for count in (1_000, 10_000, 100_000): 
+        pm = ParticleManager()
+        for _ in range(count): 
+            # timers never run out so the population stays fixed while measuring
+            pm.spawn(
+                ParticleManager.Kind.CIRC, rng.random() * WIDTH, rng.random() * HEIGHT,
+                rng.random() - 0.5, rng.random() - 0.5, 10**9, color=(3, 0, 158), dampening=0.99, rad=1
+            )
+        results[f'particles.update/n={count}'] = measure(pm.update, repeat=3)
+        results[f'particles.draw/n={count}'] = measure(lambda: pm.draw(surf), repeat=3)
+
+def bench_camera(results, rng: Random): 
+    surf = pg.Surface((WIDTH, HEIGHT))
+    am = AtlasManager(pg.image.load('assets/atlas.png').convert_alpha(), atlas_offset)
+    tree, tree_tile = am.get_sprite(ASN.Tree1), am.get_sprite(ASN.Tree1, scale=(CELL_W, CELL_W))
+    for size in (30, 100, 300, 1000): 
+        grid = Grid(rows=size, cols=size, debug=False)
+        world = grid.get_dims_pixels()
+        camera = Camera((world[0] // 2, world[1] // 2), grid.get_dims())
+        player = Player((world[0] // 2 + WIDTH // 2, world[1] // 2 + HEIGHT // 2), camera, world)
+        pm = ParticleManager()
+
+        items = [ Item(grid_index_to_coords_centered((rng.randrange(size), rng.randrange(size)), CELL_W), tree) for _ in range(ITEMS_COUNT) ]
+        obstacle_index = SpatialHash(CELL_W, margin=max(OBSTACLE_RADIUS + 1, CELL_W // 2))
+        for _ in range(size * size // 20): 
+            pos = grid_index_to_coords_centered((rng.randrange(size), rng.randrange(size)), CELL_W)
+            ob = Obstacle(pos, tree_tile, rng)
+            obstacle_index.insert(ob, ob.pos)
+
+        draw = lambda: camera.draw(surf, player, grid, items, obstacle_index, pm)
+        results[f'camera.draw/{size}x{size}/static'] = measure(draw)
+
+        # walk the camera diagonally across the world so chunks keep entering the view
+        span = (world[0] - WIDTH, world[1] - HEIGHT)
+        def pan(): 
+            camera.x = (camera.x + 7) % span[0]
+            camera.y = (camera.y + 5) % span[1]
+            draw()
+        results[f'camera.draw/{size}x{size}/pan'] = measure(pan)
+
+def bench_ui(results, rng: Random): 
+    for count in (10, 100, 1_000): 
+        nodes = []
+        cols = int(count ** 0.5) + 1
+        w = WIDTH // cols
+        for idx in range(count): 
+            i, j = divmod(idx, cols)
+            nodes.append(RectNode(tag=str(idx), bounds=pg.Rect(j * w, i * w, w - 1, w - 1)))
+
+        ui = UI()
+        start = perf_counter()
+        for node in nodes: 
+            ui.insert(node)
+        results[f'ui.insert/n={count}'] = { 'calls': count, 'total_ms': round((perf_counter() - start) * 1000, 3) }
+
+        points = [ (rng.random() * WIDTH, rng.random() * HEIGHT) for _ in range(256) ]
+        def hit_test(): 
+            for pos in points: 
+                ui.get_node(pos)
+        result = measure(hit_test)
+        result['per_query_us'] = round(result['median_us'] / len(points), 3)
+        results[f'ui.get_node/n={count}'] = result
+
+    # the main menu with one button hovered, drawn from cached node surfaces and straight to the frame
+    surf = pg.Surface((WIDTH, HEIGHT))
+    fsr = FontSpriteWriter(pg.image.load('assets/font-bold.png').convert_alpha(), 9, 9)
+    ui = init_ui(fsr, None).get_current_ui()
+    ui.root.children[0].hovered = True
+    for retained in (True, False): 
+        ui.retained = retained
+        results[f'ui.draw/menu/{"retained" if retained else "immediate"}'] = measure(lambda: ui.draw(surf))
+
+def bench_present(results, rng: Random): 
+    pc = PygameContext((WIDTH, HEIGHT), 'bench', scale=1)
+    pc.fps = 0 # never wait on the clock
+    pc.frame.fill((245, 232, 255))
+    for scale in (1, 2, 3, 4): 
+        w, h = WIDTH * scale, HEIGHT * scale
+        pg.display.set_mode((w, h))
+        pc.update_screen_dims(w, h)
+
+        def full(): 
+            pc.mark_all_dirty()
+            pc.finish_drawing_frame()
+        results[f'present/scale={scale}/full'] = measure(full)
+
+        # only a cursor sized region changes
+        pc.dirty_rects = True
+        def cursor(): 
+            pc.mark_dirty(pg.Rect(rng.randrange(WIDTH - 10), rng.randrange(HEIGHT - 10), 10, 10))
+            pc.finish_drawing_frame()
+        results[f'present/scale={scale}/dirty'] = measure(cursor)
+        pc.dirty_rects = False
+
+BENCHMARKS = {
+    'font': bench_font,
+    'particles': bench_particles,
+    'camera': bench_camera,
+    'ui': bench_ui,
+    'present': bench_present,
+}
+
+def get_meta() -> dict: 
+    try: 
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError: 
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'pygame': pg.version.ver,
+        'sdl': '.'.join(map(str, pg.get_sdl_version())),
+        'machine': platform.machine(),
+    }
+
+def compare(results, old_path): 
+    with open(old_path) as f: 
+        old = json.load(f)['results']
+    for name, result in results.items(): 
+        if name not in old or 'median_us' not in result: 
+            continue
+        ratio = result['median_us'] / old[name]['median_us']
+        logger.info('%-40s %12.1fus -> %12.1fus  x%.2f', name, old[name]['median_us'], result['median_us'], ratio)
+
+def main(): 
+    parser = argparse.ArgumentParser(description='Benchmark toolshed hot paths')
+    parser.add_argument('--only', nargs='*', choices=BENCHMARKS.keys(), help='run only these groups')
+    parser.add_argument('--out', metavar='PATH', default='bench.json', help='where to write the results')
+    parser.add_argument('--compare', metavar='PATH', help='log the change against a previous results file')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    pg.init()
+    pg.display.set_mode((WIDTH, HEIGHT))
+
+    results = {}
+    for name in args.only or BENCHMARKS.keys(): 
+        logger.info('Running %s benchmarks', name)
+        BENCHMARKS[name](results, Random(args.seed))
+
+    with open(args.out, 'w') as f: 
+        json.dump({ 'meta': get_meta(), 'results': results }, f, indent=2)
+    logger.info('Wrote %d results to %s', len(results), args.out)
+
+    if args.compare is not None: 
+        compare(results, args.compare)
+    pg.quit()
+
+if __name__ == '__main__': 
+    main()
@@ -0,0 +1,127 @@
+import os
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import argparse
+import json
+from random import Random
+from time import perf_counter
+
+import pygame as pg
+
+from toolshed import get_logger
+from toolshed.clock import VirtualClock
+from toolshed.replay import InputLog, KeyState, get_frame_time_stats
+from toolshed.particles import ParticleManager
+
+from main import App, MOVE_KEYS
+
+logger = get_logger()
+
+# level loads log at debug, which would be printed for every simulated game ... 
+# PYGAME_TOOLSHED_LOG_LEVEL or --log-level still choose the level
+if 'PYGAME_TOOLSHED_LOG_LEVEL' not in os.environ: 
+    logger.set_console_level(logger.Level.INFO)
+
+SIM_FPS = 60
+class HeadlessGame: 
+    # steps App.update from scripted input on a virtual clock ... nothing is drawn
+    # level=None keeps the level App boots into, as a recorded session does
+    def __init__(self, level='main', fps=SIM_FPS, seed=None): 
+        if pg.display.get_surface() is None: 
+            # image conversion in App.__init__ still needs a (1x1, never shown) display
+            pg.display.init()
+            pg.display.set_mode((1, 1))
+
+        self.dt = 1 / fps
+        self.clock = VirtualClock()
+        self.pm = ParticleManager(pooled=True)
+        self.app = App(self.pm, clock=self.clock, seed=seed)
+        if level is not None: 
+            self.app.load_level(level)
+        self.steps = 0
+
+    def is_over(self): 
+        return not self.app.running or self.app.state in { App.State.Gameover, App.State.Win }
+
+    # events: (InputLog.Kind, key or button, mouse pos) handled before the step
+    def step(self, keys: KeyState, events=()): 
+        for kind, code, pos in events: 
+            self.app.handle_input(kind, code, pos)
+
+        self.app.update(keys)
+        self.pm.update()
+        self.clock.advance(self.dt)
+        self.steps += 1
+
+    # script: iterable of (steps, keys) ... each set of keys is held for that many steps
+    def play(self, script, max_steps=None): 
+        pressed = frozenset()
+        for count, keys in script: 
+            keys = KeyState(keys)
+            events = [ (InputLog.Kind.KeyDown, key, (0, 0)) for key in keys.pressed - pressed ]
+            pressed = keys.pressed
+            for _ in range(count): 
+                if self.is_over() or (max_steps is not None and self.steps >= max_steps): 
+                    return self.get_result()
+                self.step(keys, events)
+                events = ()
+        return self.get_result()
+
+    # runs a recorded session as fast as possible ... timing every step
+    def replay(self, log: InputLog) -> dict: 
+        step_times = []
+        for keys, events in log: 
+            if not self.app.running: 
+                break
+            start = perf_counter()
+            self.step(keys, events)
+            step_times.append(perf_counter() - start)
+
+        result = self.get_result()
+        result['step_times'] = get_frame_time_stats(step_times)
+        return result
+
+    def get_result(self) -> dict: 
+        app = self.app
+        return {
+            'level': app.level_name,
+            'seed': app.seed,
+            'state': app.state,
+            'score': app.get_score(),
+            'steps': self.steps,
+            'sim_seconds': round(self.clock.now(), 3),
+            'snow': app.snow_collected,
+            'damaged': app.damaged_count,
+            'items': sum(not item.active for item in app.items),
+            'rad': round(app.player.rad, 2),
+        }
+
+def random_walk(rng: Random, segments, min_hold=10, max_hold=90): 
+    for _ in range(segments): 
+        yield rng.randint(min_hold, max_hold), (rng.choice(MOVE_KEYS),)
+
+def main(): 
+    parser = argparse.ArgumentParser(description='Run Snowball Effect games without a display')
+    parser.add_argument('--games', type=int, default=10)
+    parser.add_argument('--level', default='main')
+    parser.add_argument('--max-steps', type=int, default=SIM_FPS * 60 * 3)
+    parser.add_argument('--seed', type=int, default=0, help='game n is played with seed + n')
+    parser.add_argument('--log-level', choices=logger.Level.NAMES.values(), help='console log level (default INFO)')
+    args = parser.parse_args()
+
+    if args.log_level is not None: 
+        logger.set_console_level(logger.Level.from_name(args.log_level))
+
+    start = perf_counter()
+    for n in range(args.games): 
+        seed = args.seed + n
+        game = HeadlessGame(args.level, seed=seed)
+        result = game.play(random_walk(Random(seed), args.max_steps), max_steps=args.max_steps)
+        print(json.dumps(result))
+    elapsed = perf_counter() - start
+
+    logger.info('Simulated %d games in %.2fs (%.0f games/min)', args.games, elapsed, args.games / elapsed * 60)
+    pg.quit()
+
+if __name__ == '__main__': 
+    main()
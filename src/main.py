@@ -1,23 +1,31 @@
+import argparse
 import asyncio
 import math
-from random import random, randint, choice
-from time import time 
+import sys
+from array import array
+from collections import OrderedDict
+from random import Random, randrange
+from time import perf_counter
 from typing import List
+from urllib.parse import parse_qs
 
 import pygame as pg
 
-from toolshed import get_logger, debug, print_debug
+from toolshed import get_logger, get_profiler, debug
 from toolshed.window import PygameContext
 from toolshed.font import FontSpriteWriter, Dialogue
-from toolshed.vector import Vector
-from toolshed.particles import ParticleManager, PulseParticle, CircParticle, EllipseParticle
+from toolshed.particles import ParticleManager, PulseParticle, CircParticle
 from toolshed.mouse import Mouse
 from toolshed.atlas import AtlasManager
-from toolshed.varhelpers import increment_to_limit, decrement_to_limit, clamp, clamp_upper, multiply_tuple_by_int
+from toolshed.spatial import SpatialHash
+from toolshed.clock import WallClock, VirtualClock
+from toolshed.replay import InputLog, get_frame_time_stats
+from toolshed.varhelpers import increment_to_limit, decrement_to_limit, clamp, clamp_upper, multiply_tuple_by_int, lerp
 
 from utils import *
 
 logger = get_logger()
+profiler = get_profiler()
 
 def grid_index_to_coords_centered(pos, cell_w): 
     scaled = list(multiply_tuple_by_int(pos, CELL_W))
@@ -26,56 +34,150 @@ def grid_index_to_coords_centered(pos, cell_w):
     return tuple(scaled)
 
 class Cell: 
-    def __init__(self, pos): 
+    # lightweight view onto one tile of the grid's packed storage
+    __slots__ = ('grid', 'pos')
+
+    def __init__(self, grid, pos): 
+        self.grid = grid
         self.pos = pos
-        self.has_snow = True 
-        self.asset = None 
+
+    @property
+    def has_snow(self): 
+        return self.grid.has_snow(self.pos)
+
+    @has_snow.setter
+    def has_snow(self, value): 
+        self.grid.set_snow(self.pos, value)
+
+    @property
+    def asset(self): 
+        return self.grid.get_asset(self.pos)
+
+    @asset.setter
+    def asset(self, surf): 
+        self.grid.set_asset(self.pos, surf)
 
 class Grid: 
     def __init__(self, rows=ROWS, cols=COLS, debug=False): 
-        self.grid = [[Cell((j, i)) for j in range(cols)] for i in range(rows)]
+        self.rows, self.cols = rows, cols
         self.debug = debug 
-        logger.debug(f'Initialized grid with dimensions: (rows={rows}, cols={cols})')
+
+        # one bit per tile, set while the tile still has snow on it
+        self.snow = bytearray(b'\xff') * ((rows * cols + 7) // 8)
+
+        # per tile index into the shared asset table ... 0 means no asset
+        self.asset_idx = array('H', bytes(2 * rows * cols))
+        self.assets = [None]
+        self.asset_keys = {}
+
+        # how many tiles past its own the largest asset reaches ... assets are drawn centred on their tile
+        self.spill = 0
+
+        # chunks whose cached surfaces no longer match the tiles
+        self.dirty_chunks = set()
+
+        logger.debug('Initialized grid with dimensions: (rows=%d, cols=%d)', rows, cols)
 
     def get_dims(self): 
-        return len(self.grid[0]), len(self.grid)
+        return self.cols, self.rows
     
     def get_dims_pixels(self): 
         return multiply_tuple_by_int(self.get_dims(), CELL_W)
     
-    def get_cell(self, pos): 
+    def in_bounds(self, pos): 
         j, i = pos
-        dims = self.get_dims()
-        if j >= dims[0] or j < 0 or i >= dims[1] or i < 0: 
+        return 0 <= j < self.cols and 0 <= i < self.rows
+    
+    def get_cell(self, pos): 
+        if not self.in_bounds(pos): 
             return None 
-        return self.grid[i][j]
+        return Cell(self, pos)
+
+    def mark_dirty(self, pos): 
+        # assets can spill over a tile edge, so every chunk the largest one could reach is dirtied
+        j, i = pos
+        m = self.spill
+        for cj in range((j - m) // CHUNK_COLS, (j + m) // CHUNK_COLS + 1): 
+            for ci in range((i - m) // CHUNK_ROWS, (i + m) // CHUNK_ROWS + 1): 
+                self.dirty_chunks.add((cj, ci))
+
+    def has_snow(self, pos): 
+        idx = pos[1] * self.cols + pos[0]
+        return bool(self.snow[idx >> 3] & (1 << (idx & 7)))
+
+    def set_snow(self, pos, value): 
+        idx = pos[1] * self.cols + pos[0]
+        if value: 
+            self.snow[idx >> 3] |= 1 << (idx & 7)
+        else: 
+            self.snow[idx >> 3] &= ~(1 << (idx & 7)) & 0xff
+        self.mark_dirty(pos)
+
+    def get_asset(self, pos): 
+        return self.assets[self.asset_idx[pos[1] * self.cols + pos[0]]]
+
+    def set_asset(self, pos, surf, key=None): 
+        self.set_asset_idx(pos, 0 if surf is None else self.add_asset(surf, key))
+
+    def set_asset_idx(self, pos, idx): 
+        self.asset_idx[pos[1] * self.cols + pos[0]] = idx
+        self.mark_dirty(pos)
+
+    def find_asset(self, key): 
+        return self.asset_keys.get(key)
+
+    def add_asset(self, surf, key=None): 
+        # surfaces are shared between tiles, keyed by identity unless a key is given
+        key = surf if key is None else key
+        idx = self.asset_keys.get(key)
+        if idx is None: 
+            idx = len(self.assets)
+            self.assets.append(surf)
+            self.asset_keys[key] = idx
+
+            overhang = (max(surf.get_size()) - CELL_W + 1) // 2
+            self.spill = max(self.spill, -(-overhang // CELL_W))
+        return idx
+
+    def count_live_assets(self): 
+        # distinct surfaces some tile still points at
+        return len(set(self.asset_idx) - { 0 })
 
     def trample(self, pos): 
-        if pos[0] >= WIDTH or pos[0] < 0 or pos[1] >= HEIGHT or pos[1] < 0: 
+        w, h = self.get_dims_pixels()
+        if pos[0] >= w or pos[0] < 0 or pos[1] >= h or pos[1] < 0: 
             return 
         
-        j, i = int(pos[0]) // CELL_W, int(pos[1]) // CELL_W
-        self.grid[i][j].has_snow = False
+        self.set_snow((int(pos[0]) // CELL_W, int(pos[1]) // CELL_W), False)
 
 class Item: 
-    def __init__(self, pos, asset: pg.Surface, active=True): 
+    def __init__(self, pos, asset: pg.Surface, active=True, silhouette: pg.Surface = None): 
         self.pos = pos # world coords
         self.r = CELL_W // 4
         self.asset = asset
         self.active = active
 
+        # drawn in the hud until the item is picked up
+        self.silhouette = silhouette
+
 class Obstacle: 
-    def __init__(self, pos, asset: pg.Surface, rand_offset=True): 
+    def __init__(self, pos, asset: pg.Surface, rng: Random, rand_offset=True): 
         self.pos = pos # world coords
         if rand_offset: 
-            self.pos = (pos[0] + randint(-3, 3), pos[1] + randint(-3, 3))
-        self.asset = pg.transform.scale(asset, (CELL_W, CELL_W))
+            self.pos = (pos[0] + rng.randint(-3, 3), pos[1] + rng.randint(-3, 3))
+
+        # pass assets already at tile size (AtlasManager.get_sprite(..., scale=...)) to share them between obstacles
+        if asset.get_size() != (CELL_W, CELL_W): 
+            asset = pg.transform.scale(asset, (CELL_W, CELL_W))
+        self.asset = asset
         self.r = OBSTACLE_RADIUS
 
 class Player: 
-    def __init__(self, pos, camera, world_dims, radius=INITIAL_PLAYER_RAD, speed=1): 
+    def __init__(self, pos, camera, world_dims, radius=INITIAL_PLAYER_RAD, speed=1, clock=None): 
         self.x, self.y = pos # world coordinates, not indexes
+        self.prev_x, self.prev_y = pos # position before the last simulation step
         self.camera: Camera = camera
+        self.clock = WallClock() if clock is None else clock
         self.rad = radius
         self.speed = speed
         self.world_dims = world_dims
@@ -87,6 +189,9 @@ class Player:
     
     def pos(self): 
         return self.x, self.y
+
+    def get_render_pos(self, alpha=1.0): 
+        return lerp(self.prev_x, self.x, alpha), lerp(self.prev_y, self.y, alpha)
     
     def draw(self, surf): 
         color = WHITE
@@ -101,8 +206,11 @@ class Player:
         pg.draw.circle(surf, color, screen_pos, self.rad)          # base white color 
         pg.draw.circle(surf, (150,150,150), screen_pos, self.rad, width=1) # outline 
 
-    def update(self): 
-        keys = pg.key.get_pressed() 
+    def update(self, keys=None): 
+        if keys is None: 
+            keys = pg.key.get_pressed() 
+
+        self.prev_x, self.prev_y = self.x, self.y
         if keys[pg.K_w]:
             if self.y - self.rad > 0: 
                 self.y -= self.speed 
@@ -122,71 +230,108 @@ class Player:
         self.iframes = decrement_to_limit(self.iframes) 
 
         if self.last_inc is not None: 
-            now = time()
+            now = self.clock.now()
             if now - self.last_inc > PLAYER_SEC_TO_MELTING: 
                 self.rad *= OBSTACLE_PENALTY_MULTIPLIER
                 self.last_inc = now 
 
-            debug['ptimer'] = f'{(self.last_inc%100):.2f}'
-        debug['r'] = f'{self.rad:.1f}'
-
 class Camera: 
     # TODO Cannot draw grids that are smaller than camera view ... only same size or larger
     def __init__(self, pos, grid_dims): 
         self.x, self.y = pos # world position 
+        self.prev_x, self.prev_y = pos
         self.grid_dims = grid_dims # indexes, not pixels
-        logger.debug(f'Initialized Camera with pos: {self.x, self.y} and grid_dims: {grid_dims}')
+        self.chunks = OrderedDict() # chunk index -> pre-rendered terrain surface
+        logger.debug('Initialized Camera with pos: %s and grid_dims: %s', (self.x, self.y), grid_dims)
 
     def get_tile_range(self): 
         j = clamp(self.x, upper=(self.grid_dims[0] - COLS) * CELL_W, lower=0) // CELL_W
         i = clamp(self.y, upper=(self.grid_dims[1] - ROWS) * CELL_W, lower=0) // CELL_W
         return int(j), int(i)
-    
-    def draw(self, surf: pg.Surface, p: Player, g: Grid, items: List[Item], obstacles: List[Obstacle], pm: ParticleManager): 
-        clampedx = clamp(self.x, upper=(self.grid_dims[0] - COLS) * CELL_W, lower=0)
-        clampedy = clamp(self.y, upper=(self.grid_dims[1] - ROWS) * CELL_W, lower=0)
-
-        j, i = self.get_tile_range()
-        extra_j = 0 if j == self.grid_dims[0] - COLS else 1
-        extra_i = 0 if i == self.grid_dims[1] - ROWS else 1
-        end_j = min(j + COLS + extra_j, self.grid_dims[0])
-        end_i = min(i + ROWS + extra_i, self.grid_dims[1])
-        camera_view = [
-            row[j:end_j] for row in g.grid[i:end_i]
-        ]
 
-        # draw grid 
-        x_off, y_off = clampedx % CELL_W, clampedy % CELL_W
-        for row_idx, row in enumerate(camera_view): 
-            for col_idx, cell in enumerate(row): 
-                # light gray if trampled, else white
-                color = WHITE   
-                rect = pg.Rect(col_idx * CELL_W - x_off, row_idx * CELL_W - y_off, CELL_W, CELL_W)
-                pg.draw.rect(surf, color, rect)
-
-                if cell.asset is not None: 
-                    w, h = cell.asset.get_size()
+    def render_chunk(self, g: Grid, chunk_pos, chunk: pg.Surface): 
+        cj, ci = chunk_pos
+        j0, i0 = cj * CHUNK_COLS, ci * CHUNK_ROWS
+
+        # include a margin so assets spilling in from neighbouring chunks are kept
+        m = g.spill
+        start_j, end_j = max(j0 - m, 0), min(j0 + CHUNK_COLS + m, g.cols)
+        start_i, end_i = max(i0 - m, 0), min(i0 + CHUNK_ROWS + m, g.rows)
+
+        chunk.fill((0,0,0))
+        for i in range(start_i, end_i): 
+            row_start = i * g.cols
+            y = (i - i0) * CELL_W
+            for j in range(start_j, end_j): 
+                x = (j - j0) * CELL_W
+                rect = pg.Rect(x, y, CELL_W, CELL_W)
+                pg.draw.rect(chunk, WHITE, rect)
+
+                asset = g.assets[g.asset_idx[row_start + j]]
+                if asset is not None: 
+                    w, h = asset.get_size()
                     pad_w, pad_h = (CELL_W - w) // 2, (CELL_W - h) // 2
-                    surf.blit(cell.asset, (col_idx * CELL_W - x_off + pad_w, row_idx * CELL_W - y_off + pad_h))
+                    chunk.blit(asset, (x + pad_w, y + pad_h))
 
                 if g.debug: 
-                    pg.draw.rect(surf, (225,225,225), rect, width=1) # outline
+                    pg.draw.rect(chunk, (225,225,225), rect, width=1) # outline
+
+    def get_chunk(self, g: Grid, chunk_pos) -> pg.Surface: 
+        chunk = self.chunks.get(chunk_pos)
+        if chunk is None or chunk_pos in g.dirty_chunks: 
+            if chunk is None: 
+                # recycle the least recently used chunk surface once the cache is full
+                if len(self.chunks) >= CHUNK_CACHE_SIZE: 
+                    _, chunk = self.chunks.popitem(last=False)
+                else: 
+                    chunk = pg.Surface((CHUNK_COLS * CELL_W, CHUNK_ROWS * CELL_W))
+                self.chunks[chunk_pos] = chunk
+
+            self.render_chunk(g, chunk_pos, chunk)
+            g.dirty_chunks.discard(chunk_pos)
+
+        self.chunks.move_to_end(chunk_pos)
+        return chunk
+    
+    # alpha blends between the previous and current simulation step for rendering
+    def get_view_rect(self, alpha=1.0) -> pg.FRect: 
+        x, y = lerp(self.prev_x, self.x, alpha), lerp(self.prev_y, self.y, alpha)
+        clampedx = clamp(x, upper=(self.grid_dims[0] - COLS) * CELL_W, lower=0)
+        clampedy = clamp(y, upper=(self.grid_dims[1] - ROWS) * CELL_W, lower=0)
+        return pg.FRect(clampedx, clampedy, WIDTH, HEIGHT)
+
+    def in_view(self, pos, r=0): 
+        # true if a circle of radius r around pos overlaps the camera view
+        view = self.get_view_rect()
+        return (
+            view.x - r <= pos[0] <= view.x + view.w + r
+            and view.y - r <= pos[1] <= view.y + view.h + r
+        )
+    
+    def draw(self, surf: pg.Surface, p: Player, g: Grid, items: List[Item], obstacle_index: SpatialHash, pm: ParticleManager, alpha=1.0): 
+        view = self.get_view_rect(alpha)
+        clampedx, clampedy = view.x, view.y
+
+        # draw grid from cached chunks ... at most 4 are visible at once
+        chunk_w, chunk_h = CHUNK_COLS * CELL_W, CHUNK_ROWS * CELL_W
+        start_cj, end_cj = int(clampedx // chunk_w), int((clampedx + WIDTH - 1) // chunk_w)
+        start_ci, end_ci = int(clampedy // chunk_h), int((clampedy + HEIGHT - 1) // chunk_h)
+        for ci in range(start_ci, end_ci + 1): 
+            for cj in range(start_cj, end_cj + 1): 
+                chunk = self.get_chunk(g, (cj, ci))
+                surf.blit(chunk, (cj * chunk_w - clampedx, ci * chunk_h - clampedy))
 
         # draw items
         def item_in_camera_view(item: Item): 
-            return ( 
-                item.active
-                and clampedx <= item.pos[0] <= clampedx + WIDTH * CELL_W
-                and clampedy <= item.pos[1] <= clampedy + HEIGHT * CELL_W
-            )
+            return item.active and self.in_view(item.pos, item.r)
         for item in filter(item_in_camera_view, items): 
             pos = (item.pos[0] - clampedx, item.pos[1] - clampedy)
             pg.draw.circle(surf, (224, 229, 255), pos, radius=item.r)
             surf.blit(item.asset, (pos[0]-item.r, pos[1]-item.r))
 
-        # draw obstacles 
+        # draw obstacles that overlap the view
         # TODO: make aura transparent
-        for ob in obstacles: 
+        for ob in obstacle_index.query(view): 
             pos = (ob.pos[0] - clampedx, ob.pos[1] - clampedy)
             pg.draw.circle(surf, (245, 232, 255), pos, radius=ob.r) 
             w, h = ob.asset.get_size()
@@ -201,15 +346,16 @@ class Camera:
             if p.iframe_draw_state_red: 
                 color = (255,200,200)
 
-        screen_pos = (p.x - clampedx, p.y - clampedy) 
+        px, py = p.get_render_pos(alpha)
+        screen_pos = (px - clampedx, py - clampedy) 
         pg.draw.circle(surf, color, screen_pos, p.rad)          # base white color 
         pg.draw.circle(surf, (150,150,150), screen_pos, p.rad, width=1) # outline 
 
         # draw the rest of the particles 
-        for particle in filter(lambda x: not isinstance(x, EllipseParticle), pm.particles):
-            particle.draw(surf, draw_pos=(particle.pos.x - clampedx, particle.pos.y - clampedy))
+        pm.draw(surf, offset=(-clampedx, -clampedy), exclude={ ParticleManager.Kind.ELLIPSE })
 
     def update(self, old_pos, new_pos): 
+        self.prev_x, self.prev_y = self.x, self.y
         self.x += new_pos[0] - old_pos[0]
         self.y += new_pos[1] - old_pos[1]
 
@@ -220,32 +366,53 @@ def collide_player_obstacle(player: Player, ob: Obstacle):
     # flipx, flipy, _, _ = collide_circ_and_bounding_rect(player.x, player.y, player.rad, ob.col_box)
     return (player.x-ob.pos[0])**2 + (player.y-ob.pos[1])**2 < (player.rad + ob.r)**2
 
-def consume_snow(player: Player, grid: Grid, pm: ParticleManager, am: AtlasManager): 
+class TrampledCache: 
+    VARIANTS = ( ASN.TrampledSnow1, ASN.TrampledSnow2, ASN.TrampledSnow3 )
+
+    # scaled trampled snow sprites come from the atlas cache so they are kept for the whole session 
+    # and shared by every grid ... sizes are rounded to TRAMPLED_SIZE_STEP so nearby radii reuse one surface
+    def __init__(self, am: AtlasManager): 
+        self.am = am
+
+    def __len__(self): 
+        return self.am.count_variants(self.VARIANTS)
+
+    def get_key(self, variant, rad): 
+        size = max(round(rad * 2 / TRAMPLED_SIZE_STEP), 1) * TRAMPLED_SIZE_STEP
+        return (variant, size)
+
+    def get(self, key) -> pg.Surface: 
+        variant, size = key
+        return self.am.get_sprite(variant, scale=(size, size))
+
+def consume_snow(player: Player, grid: Grid, pm: ParticleManager, trampled: TrampledCache, rng: Random): 
     pos = player.pos() 
     px, py = pos
     j, i = (int(pos[0]) // CELL_W, int(pos[1]) // CELL_W)
-    tile = grid.get_cell((j, i))
-    if tile is None or not tile.has_snow:
+    if not grid.in_bounds((j, i)) or not grid.has_snow((j, i)):
         return 
 
     tx, ty = j * CELL_W + CELL_W // 2, i * CELL_W + CELL_W // 2
     if (tx-px)**2 + (ty-py)**2 < player.rad**2: 
-        tile.has_snow = False 
+        grid.set_snow((j, i), False) 
         player.rad += PLAYER_RAD_SNOW_INC
-        player.last_inc = time() 
-
-        trampled_assets = [ ASN.TrampledSnow1, ASN.TrampledSnow2, ASN.TrampledSnow3 ]
-        tile.asset = pg.transform.scale(am.get_sprite(choice(trampled_assets)), (player.rad*2, player.rad*2))
+        player.last_inc = player.clock.now() 
+
+        # trampled sprites are shared between tiles of the same variant and size
+        key = trampled.get_key(rng.choice(TrampledCache.VARIANTS), player.rad)
+        idx = grid.find_asset(key)
+        if idx is None: 
+            idx = grid.add_asset(trampled.get(key), key)
+        grid.set_asset_idx((j, i), idx)
         return True
     
     return False 
-        # logger.debug(f'Player radius grew to {player.rad}')
+        # logger.debug('Player radius grew to %.2f', player.rad)
 
-def update_camera_and_player_pos(c: Camera, p: Player): 
+def update_camera_and_player_pos(c: Camera, p: Player, keys=None): 
     old_pos = p.pos()
-    p.update()
+    p.update(keys)
     c.update(old_pos, p.pos())
-    debug['p-pos'] = f'{(p.pos())}'
 
 class App: 
     class State:
@@ -257,10 +424,23 @@ class App:
         Win = 'Win'
         Editing = 'Editing'
 
-    def __init__(self, pm: ParticleManager): 
+    # states whose screens only change in response to input
+    STATIC_STATES = { State.Menu, State.Lore }
+
+    def __init__(self, pm: ParticleManager, clock=None, seed=None): 
         self.running = True 
+
+        # all gameplay time and randomness comes from here so a run can be reproduced from its seed
+        self.clock = WallClock() if clock is None else clock
+        self.seed = randrange(2**32) if seed is None else seed
+        self.rng = Random(self.seed)
+        logger.debug('Using gameplay seed: %d', self.seed)
         self.state = App.State.Menu
 
+        # set when a static screen needs to be pushed to the display in full
+        self.redraw = True
+        self.hovered_tag = None
+
         # particles vars 
         self.pm = pm
 
@@ -283,10 +463,15 @@ class App:
         big_font = pg.transform.scale(font, (multiply_tuple_by_int(font.get_size(), ratio)))
         self.fsr = FontSpriteWriter(font, 9, 9)
         self.big_fsr = FontSpriteWriter(big_font, 12, 12)
+        for fsr in (self.fsr, self.big_fsr): 
+            fsr.prebake(FONT_PALETTE)
+        if logger.is_enabled(logger.Level.DEBUG): 
+            logger.debug('Pre-baked font tints: %d KB', (self.fsr.get_tint_memory() + self.big_fsr.get_tint_memory()) // 1024)
     
         # assets
         atlas = pg.image.load('assets/atlas.png').convert_alpha()
         self.am = AtlasManager(atlas, atlas_offset)
+        self.trampled = TrampledCache(self.am)
         self.sm: SceneManager = init_ui(self.fsr, self.am.get_atlas())
 
         # game vars
@@ -296,6 +481,8 @@ class App:
         self.player = None 
         self.items = []
         self.obstacles = []
+        self.item_index = None
+        self.obstacle_index = None
         self.start_time = 0
         self.last_updated_time = 0
         self.snow_collected = 0 
@@ -304,6 +491,15 @@ class App:
         # editor vars
         self.picked = []
 
+        # only read while the debug overlay is shown
+        debug.watch('state', lambda: self.state)
+        debug.watch('snow', lambda: self.snow_collected)
+        debug.watch('r', lambda: self.player.rad, '.1f')
+        debug.watch('ptimer', lambda: None if self.player.last_inc is None else self.player.last_inc % 100, '.2f')
+        debug.watch('p-pos', lambda: self.player.pos())
+        debug.watch('tile sprites', lambda: self.grid.count_live_assets())
+        debug.watch('trampled cached', lambda: len(self.trampled))
+
         self.load_level('tutorial')
 
     def init_lore(self): 
@@ -311,7 +507,7 @@ class App:
         self.lore_idx = 0
         self.lore_played = True
 
-    def draw(self, surf: pg.Surface): 
+    def draw(self, surf: pg.Surface, alpha=1.0): 
         if self.state == App.State.Menu: 
             surf.fill(WHITE)
             self.draw_menu(surf)
@@ -320,7 +516,13 @@ class App:
             self.draw_lore(surf) 
 
         elif self.state in { App.State.Setup, App.State.Running, App.State.Gameover, App.State.Win, App.State.Editing }: 
-            self.camera.draw(surf, self.player, self.grid, self.items, self.obstacles, self.pm)
+            # positions only advance while running ... otherwise prev and current are stale and must not be blended
+            if self.state != App.State.Running: 
+                alpha = 1.0
+
+            profiler.begin('camera')
+            self.camera.draw(surf, self.player, self.grid, self.items, self.obstacle_index, self.pm, alpha)
+            profiler.end()
 
             if self.state == App.State.Gameover: 
                 self.draw_gameover(surf)
@@ -338,13 +540,7 @@ class App:
             pad = 2 
             w, _ = self.items[0].asset.get_size()
             for idx, item in enumerate(self.items): 
-                asset = item.asset
-                if item.active: 
-                    asset = pg.mask.from_surface(item.asset)
-                    asset.invert()
-                    asset = asset.to_surface()
-                    asset.set_colorkey((255,255,255))
-                    # asset.fill((0,0,0), special_flags=pg.BLEND_RGB_MULT)
+                asset = item.silhouette if item.active else item.asset
                 surf.blit(asset, (pad + (w+pad)*idx, pad))
 
     def draw_timer(self, surf): 
@@ -473,54 +669,61 @@ class App:
             self.fsr.render(surf, Dialogue(s, rect), (3, 0,158))
             surf.blit(self.am.get_sprite(ASN.RightClick), (WIDTH//4*3-l//2-2-16, HEIGHT-5-sh*2))
  
-    def update(self): 
+    def update(self, keys=None): 
+        profiler.begin('particles')
         self.pm.update() 
+        profiler.end()
 
         if self.state != App.State.Running: 
             return 
         
-        self.last_updated_time = time()
+        self.last_updated_time = self.clock.now()
         
-        update_camera_and_player_pos(self.camera, self.player)
-        if consume_snow(self.player, self.grid, self.pm, self.am): 
+        update_camera_and_player_pos(self.camera, self.player, keys)
+        if consume_snow(self.player, self.grid, self.pm, self.trampled, self.rng): 
             self.snow_collected += 1
-            debug['snow'] = self.snow_collected
 
-        active_items = list(filter(lambda item: item.active, self.items))
-        for item in active_items:
-            if collide_player_item(self.player, item): 
+        # only test items and obstacles in the player's neighbourhood
+        for item in self.item_index.query_radius(self.player.pos(), self.player.rad):
+            if item.active and collide_player_item(self.player, item): 
                 item.active = False 
-                if len(active_items) == 1: 
+                self.item_index.remove(item, item.pos)
+                if len(self.item_index) == 0: 
                     self.change_state(App.State.Win)
-                    logger.debug(f'You finished in {(time()-self.start_time):.2f} seconds!')
+                    logger.debug('You finished in %.2f seconds!', self.clock.now() - self.start_time)
                 
                 for _ in range(20): 
                     self.pm.add_particle(
-                        CircParticle(
-                            pos=Vector(self.player.x, self.player.y), 
-                            vel=Vector((random()-0.5)*5, (random()-0.5)*5), 
+                        self.pm.make_particle(
+                            CircParticle, 
+                            pos=(self.player.x, self.player.y), 
+                            vel=((self.rng.random()-0.5)*5, (self.rng.random()-0.5)*5), 
                             color=(3, 0, 158), 
-                            timer=randint(45, 60), 
+                            timer=self.rng.randint(45, 60), 
                             dampening=0.9, 
                             rad=1
                         )
                     )
 
-        for ob in self.obstacles: 
-            ob.r = OBSTACLE_RADIUS + math.sin(time()+random()*2*math.pi)
+        # only obstacles on screen need their aura animated
+        for ob in self.obstacle_index.query(self.camera.get_view_rect()): 
+            ob.r = OBSTACLE_RADIUS + math.sin(self.clock.now()+self.rng.random()*2*math.pi)
+
+        for ob in self.obstacle_index.query_radius(self.player.pos(), self.player.rad): 
             if collide_player_obstacle(self.player, ob) and self.player.iframes is None: 
                 self.player.rad *= OBSTACLE_PENALTY_MULTIPLIER
                 self.player.iframes = PLAYER_IFRAMES
                 self.damaged_count += 1
-                logger.debug(f'Player radius was reduced')  
+                logger.debug('Player radius was reduced')  
 
                 for _ in range(20): 
                     self.pm.add_particle(
-                        CircParticle(
-                            pos=Vector(self.player.x, self.player.y), 
-                            vel=Vector((random()-0.5)*5, (random()-0.5)*5), 
+                        self.pm.make_particle(
+                            CircParticle, 
+                            pos=(self.player.x, self.player.y), 
+                            vel=((self.rng.random()-0.5)*5, (self.rng.random()-0.5)*5), 
                             color=(255,200,200), 
-                            timer=randint(45, 60), 
+                            timer=self.rng.randint(45, 60), 
                             dampening=0.9, 
                             rad=1
                         )
@@ -528,9 +731,10 @@ class App:
 
         if self.player.rad < MINIMUM_PLAYER_RAD: 
             self.change_state(App.State.Gameover) 
-            logger.debug(f'GAMEOVER ... you died after {(time()-self.start_time):.2f} seconds')
+            logger.debug('GAMEOVER ... you died after %.2f seconds', self.clock.now() - self.start_time)
 
     def handle_event_mouse_button_up(self, button, mpos): 
+        self.redraw = True
         node = self.sm.get_node(mpos)
         if self.state == App.State.Menu: 
             if node is not None: 
@@ -568,8 +772,8 @@ class App:
                                     
 
         self.pm.add_particle(
-            PulseParticle(
-                pos=Vector(mpos[0], mpos[1]), vel=Vector(0,0), 
+            self.pm.make_particle(
+                PulseParticle, pos=mpos, vel=(0,0), 
                 timer=30, color=(117, 138, 255), rad=4
             )
         ) 
@@ -581,17 +785,34 @@ class App:
         else: 
             self.sm.hover(node) 
 
+        hovered_tag = None if node is None else node.tag
+        if hovered_tag != self.hovered_tag: 
+            self.hovered_tag = hovered_tag
+            self.redraw = True
+
+    # single entry point for input events ... shared by the live loop, replays and headless runs
+    def handle_input(self, kind, code, mpos): 
+        if kind == InputLog.Kind.KeyDown: 
+            self.handle_event_key_down(code)
+
+        elif kind == InputLog.Kind.MouseButtonUp: 
+            self.handle_event_mouse_button_up(code, mpos)
+
+        elif kind == InputLog.Kind.MouseMotion: 
+            self.handle_event_mouse_motion(mpos)
+
     def handle_event_key_down(self, key): 
         if key in {pg.K_w, pg.K_a, pg.K_s, pg.K_d}: 
             if self.state in App.State.Setup: 
                 self.change_state(App.State.Running)
-                self.player.last_inc = time() 
+                self.player.last_inc = self.clock.now() 
 
     def change_state(self, new_state): 
         self.state =  new_state
-        debug['state'] = new_state
+        self.redraw = True
 
     def load_level(self, name): 
+        logger.debug('Loading level %s ... %d trampled snow sprites cached', name, len(self.trampled))
         self.level_name = name
         level = levels[name]
         cols, rows = level['grid_dims']
@@ -599,31 +820,47 @@ class App:
         
         self.grid = Grid(cols=cols, rows=rows, debug=True)
         self.camera = Camera((player_pos[0] - WIDTH//2, player_pos[1] - HEIGHT//2), self.grid.get_dims())
-        self.player = Player(player_pos, self.camera, self.grid.get_dims_pixels(), speed=1) 
+        self.player = Player(player_pos, self.camera, self.grid.get_dims_pixels(), speed=1, clock=self.clock) 
 
         self.items = []
         possible_items = [ ASN.Scarf, ASN.Hat, ASN.Buttons, ASN.Carrot, ASN.Coal ]
         for i in range(ITEMS_COUNT): 
-            item_type = choice(possible_items)
+            item_type = self.rng.choice(possible_items)
             possible_items.remove(item_type)
             self.items.append(
-                Item(grid_index_to_coords_centered(level['items'][i], CELL_W), asset=self.am.get_sprite(item_type))
+                Item(
+                    grid_index_to_coords_centered(level['items'][i], CELL_W), 
+                    asset=self.am.get_sprite(item_type), 
+                    silhouette=self.am.get_sprite(item_type, inverted_mask=True)
+                )
             )
 
         trees = [ ASN.Tree1, ASN.Tree2, ASN.Tree3 ]
         self.obstacles = [
-            Obstacle(grid_index_to_coords_centered(pos, CELL_W), self.am.get_sprite(choice(trees))) 
+            Obstacle(grid_index_to_coords_centered(pos, CELL_W), self.am.get_sprite(self.rng.choice(trees), scale=(CELL_W, CELL_W)), self.rng) 
             for pos in level['obstacles'] 
         ]
+
+        # bucket items and obstacles by tile for collision and culling queries
+        self.item_index = SpatialHash(CELL_W)
+        for item in self.items: 
+            self.item_index.insert(item, item.pos)
+
+        # margin covers the aura (which wobbles by 1) and the sprite drawn around each obstacle
+        self.obstacle_index = SpatialHash(CELL_W, margin=max(OBSTACLE_RADIUS + 1, CELL_W // 2))
+        for ob in self.obstacles: 
+            self.obstacle_index.insert(ob, ob.pos)
+
         self.obtained_items = [ False for _ in range(ITEMS_COUNT) ]
-        self.start_time = time() 
+        self.start_time = self.clock.now() 
         self.last_updated_time = self.start_time
         self.state = App.State.Setup
+        self.redraw = True
 
     def reset(self): 
         if self.level_name is not None: 
             self.load_level(self.level_name)
-        logger.info(f'Successfully reloaded level: {self.level_name}')
+        logger.info('Successfully reloaded level: %s', self.level_name)
 
     # 1pt = .1 sec below 2 min ( if player won only )
     # 3pt = 1 snow collected
@@ -639,13 +876,44 @@ class App:
         return clamp_upper(total_score, total_score+1)
 
 
-async def run(): 
+# keys read by Player.update ... these are the only held keys an input log needs
+MOVE_KEYS = (pg.K_w, pg.K_a, pg.K_s, pg.K_d)
+
+def get_requested_fps(): 
+    # the web build reads ?fps=30 from its url so players on weak browsers can opt in up front
+    if sys.platform != 'emscripten': 
+        return None
+    import platform
+    fps = parse_qs(str(platform.window.location.search).lstrip('?')).get('fps', [''])[0]
+    return int(fps) if fps.isdigit() else None
+
+async def run(record_path=None, replay_path=None, profile_path=None, fps=None): 
     print(set(levels['main']['obstacles']))
 
-    pc = PygameContext((WIDTH, HEIGHT), 'Snowball Effect', icon_path='assets/icon-1024.png')
+    # without a requested rate the game renders at RENDER_FPS and falls back to LOW_RENDER_FPS if it can't keep up
+    fps = get_requested_fps() if fps is None else fps
+    auto_fps = fps is None
+    pc = PygameContext((WIDTH, HEIGHT), 'Snowball Effect', icon_path='assets/icon-1024.png', fps=fps or RENDER_FPS, dirty_rects=True)
     running = True
-    pm = ParticleManager()
-    app = App(pm)
+    pm = ParticleManager(pooled=True)
+
+    # the game only sees simulated time, which advances by SIM_DT per step
+    sim_clock = VirtualClock()
+    replay = None if replay_path is None else InputLog.load(replay_path)
+    app = App(pm, clock=sim_clock, seed=None if replay is None else replay.seed)
+    record = None if record_path is None else InputLog(MOVE_KEYS, app.seed, SIM_HZ)
+
+    # a replay supplies its own input in place of the player's ... the window still takes quit and resize
+    replay_steps = None if replay is None else iter(replay)
+    frame_times = []
+
+    # phases are timed every frame ... the overlay is toggled with PROFILER_KEY
+    profiler.enabled = True
+    if profile_path is not None: 
+        profiler.keep_rows()
+
+    accumulator = 0
+    last_frame_time = perf_counter()
     mouse = Mouse(
         rad=4, 
         outline_color=(117, 138, 255), 
@@ -657,8 +925,16 @@ async def run():
 
     try: 
         while running and app.running: 
+            profiler.begin('events')
             mpos = pc.get_event_context().mouse_pos
+
+            # motion is coalesced and handled once after the loop
+            motion = []
             for event in pg.event.get(): 
+                if event.type == pg.MOUSEMOTION: 
+                    motion.append(pc.scale_mouse_pos(event.pos))
+                    continue
+
                 mouse.handle_event(event, pm)
                 if event.type == pg.QUIT: 
                     running = False 
@@ -666,35 +942,120 @@ async def run():
                 elif event.type == pg.VIDEORESIZE: 
                     pc.update_screen_dims(event.w, event.h)
 
-                elif event.type == pg.MOUSEMOTION: 
-                    app.handle_event_mouse_motion(mpos)
+                elif event.type == pg.KEYDOWN and event.key == PROFILER_KEY: 
+                    profiler.toggle_overlay()
+                    app.redraw = True
+
+                elif event.type == pg.KEYDOWN and event.key == DEBUG_KEY: 
+                    debug.toggle()
+                    app.redraw = True
+
+                elif replay is not None: 
+                    continue
 
                 elif event.type == pg.KEYDOWN: 
-                    app.handle_event_key_down(event.key)
+                    app.handle_input(InputLog.Kind.KeyDown, event.key, mpos)
+                    if record is not None: 
+                        record.add_event(InputLog.Kind.KeyDown, event.key, mpos)
 
                 elif event.type == pg.MOUSEBUTTONUP: 
-                    logger.debug(f'Mouse clicked at ({mpos[0]:.{2}f}, {mpos[1]:.{2}f})')
-                    app.handle_event_mouse_button_up(event.button, mpos)
+                    logger.debug('Mouse clicked at (%.2f, %.2f)', mpos[0], mpos[1])
+                    app.handle_input(InputLog.Kind.MouseButtonUp, event.button, mpos)
+                    if record is not None: 
+                        record.add_event(InputLog.Kind.MouseButtonUp, event.button, mpos)
+
+            # every position feeds the trail but only the newest one is hit-tested
+            if len(motion) > 0: 
+                mouse.handle_motion(motion, pm)
+                if replay is None: 
+                    app.handle_input(InputLog.Kind.MouseMotion, 0, motion[-1])
+                    if record is not None: 
+                        record.add_event(InputLog.Kind.MouseMotion, 0, motion[-1])
+            profiler.end()
             
-            app.update()
-            pm.update()
+            # catch the simulation up with real time ... a long stall drops steps instead of spiralling
+            now = perf_counter()
+            frame_times.append(now - last_frame_time)
+            if auto_fps and len(frame_times) % SLOW_FRAME_WINDOW == 0: 
+                p50 = get_frame_time_stats(frame_times[-SLOW_FRAME_WINDOW:])['p50_ms'] / 1000
+                if p50 > SLOW_FRAME_BUDGET_RATIO / RENDER_FPS: 
+                    pc.fps = LOW_RENDER_FPS
+                    auto_fps = False
+                    logger.info('Frames took %.1fms against a %.1fms budget ... rendering at %d fps', p50 * 1000, 1000 / RENDER_FPS, LOW_RENDER_FPS)
+            accumulator = min(accumulator + now - last_frame_time, MAX_SIM_STEPS_PER_FRAME * SIM_DT)
+            last_frame_time = now
+            keys = pg.key.get_pressed()
+            while accumulator >= SIM_DT: 
+                if replay_steps is not None: 
+                    keys, events = next(replay_steps, (None, None))
+                    if keys is None: 
+                        app.running = False
+                        break
+                    for kind, code, pos in events: 
+                        app.handle_input(kind, code, pos)
+
+                elif record is not None: 
+                    record.record_step(keys)
+
+                profiler.begin('update')
+                app.update(keys)
+                profiler.end()
+
+                profiler.begin('particles')
+                pm.update()
+                profiler.end()
+                sim_clock.advance(SIM_DT)
+                accumulator -= SIM_DT
             mouse.update(pc.get_event_context().mouse_pos)
 
+            # the ui phase is everything drawn outside of the camera
+            profiler.begin('ui')
             pc.frame.fill((0,0,0))
-            app.draw(pc.frame) 
-            pm.draw(pc.frame)
-            mouse.draw(pc.frame)
+            app.draw(pc.frame, accumulator / SIM_DT) 
+            # gameplay pushes the whole frame, so particle areas are only gathered on the static screens
+            static = app.state in App.STATIC_STATES
+            profiler.begin('particles')
+            particle_rects = pm.draw(pc.frame, want_rects=static)
+            profiler.end()
+            overlay_rect = profiler.draw_overlay(pc.frame, app.fsr)
+            debug_rect = debug.draw(pc.frame, app.fsr, bottomleft=(1, HEIGHT))
+            mouse_rect = mouse.draw(pc.frame)
+            profiler.end()
+
+            if app.redraw or not static or particle_rects is None: 
+                pc.mark_all_dirty()
+                app.redraw = False
+
+            # static screens only push the regions the cursor and particles touched ... 
+            # they are marked on a full redraw too so the next frame erases them
+            if static: 
+                pc.mark_dirty(mouse_rect, overlay_rect, debug_rect, *(particle_rects or []))
             pc.finish_drawing_frame()
+            profiler.end_frame()
             await asyncio.sleep(0) 
 
     except (KeyboardInterrupt, asyncio.CancelledError): 
         logger.info('KeyboardInterrupt recorded... exiting now') 
 
     except Exception as ex: 
-        logger.error(f'Error encounted in main game loop', ex) 
+        logger.error('Error encounted in main game loop', ex=ex) 
+
+    if record is not None: 
+        record.save(record_path)
+    if replay is not None: 
+        logger.info('Replayed %d steps: %s', len(replay), get_frame_time_stats(frame_times[1:]))
+    if profile_path is not None: 
+        profiler.dump_csv(profile_path)
+        logger.info('Saved %d frames of phase timings to %s', profiler.frame_count, profile_path)
 
     pg.quit()
     print('Successfully exited program ...') 
 
 if __name__ == '__main__': 
-    asyncio.run(run())
+    parser = argparse.ArgumentParser(description='Snowball Effect')
+    parser.add_argument('--record', metavar='PATH', help='save this session\'s input to PATH')
+    parser.add_argument('--replay', metavar='PATH', help='play back input recorded with --record')
+    parser.add_argument('--profile', metavar='PATH', help='write per-frame phase timings to a csv at PATH on exit')
+    parser.add_argument('--fps', type=int, help=f'render at this rate instead of {RENDER_FPS} with a fallback to {LOW_RENDER_FPS} on slow machines')
+    args, _ = parser.parse_known_args()
+    asyncio.run(run(record_path=args.record, replay_path=args.replay, profile_path=args.profile, fps=args.fps))
@@ -0,0 +1,28 @@
+import argparse
+import asyncio
+import json
+
+from toolshed.replay import InputLog
+
+# sessions are recorded with: python src/main.py --record session.input
+def main(): 
+    parser = argparse.ArgumentParser(description='Replay a recorded Snowball Effect session')
+    parser.add_argument('path')
+    parser.add_argument('--fast', action='store_true', help='replay headless at maximum speed instead of in real time')
+    args = parser.parse_args()
+
+    if args.fast: 
+        # imported here so the dummy video driver is only selected for headless replays
+        from headless import HeadlessGame
+        import pygame as pg
+
+        log = InputLog.load(args.path)
+        game = HeadlessGame(level=None, fps=log.tick_rate, seed=log.seed)
+        print(json.dumps(game.replay(log)))
+        pg.quit()
+    else: 
+        from main import run
+        asyncio.run(run(replay_path=args.path))
+
+if __name__ == '__main__': 
+    main()
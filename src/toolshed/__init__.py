@@ -1,4 +1,6 @@
 
+import pygame as pg
+
 from .logger import Logger 
 from .font import FontSpriteWriter, Dialogue
 
@@ -6,13 +8,14 @@ logger = Logger()
 def get_logger(): 
     return logger
 
-debug = {}
-def print_debug(surf: pg.Surface, fsr: FontSpriteWriter, color=(0,0,0)): 
-    i = 0 
-    for k, v in debug.items(): 
-        s = str(k)
-        if v is not None: 
-            s += f': {v}'
-        w, h = fsr.sprite_w, fsr.sprite_h
-        fsr.render(surf, Dialogue(s, pg.Rect(1, (h+1)*i, len(s)*w, h)), color)
-        i += 1
\ No newline at end of file
+from .profiler import Profiler
+
+profiler = Profiler()
+def get_profiler(): 
+    return profiler
+
+from .overlay import DebugOverlay
+
+debug = DebugOverlay()
+def print_debug(surf: pg.Surface, fsr: FontSpriteWriter, color=(0,0,0)) -> pg.Rect | None: 
+    return debug.draw(surf, fsr, color)
@@ -1,11 +1,61 @@
+import pygame as pg
 
 class AtlasManager:
     def __init__(self, sprite_sheet: pg.Surface, offsets): 
-        self.sprite_sheet = sprite_sheet 
+        self.sprite_sheet = sprite_sheet
         self.offsets = offsets
 
-    def get_sprite(self, sprite_name) -> pg.Surface: 
-        return self.sprite_sheet.subsurface(self.offsets[sprite_name]) 
-    
+        # sprite name -> subsurface of the sheet
+        self.sprites = {}
+
+        # (sprite name, scale, flip, tint, inverted mask) -> transformed copy
+        self.variants = {}
+
+    def __len__(self): 
+        return len(self.sprites) + len(self.variants)
+
+    def count_variants(self, sprite_names=None): 
+        # cached transformed copies, optionally only of the given sprites
+        if sprite_names is None: 
+            return len(self.variants)
+        return sum(1 for key in self.variants if key[0] in sprite_names)
+
+    # returned surfaces are shared between callers and must not be drawn on ...
+    # scale is a (w, h) size, flip is (x, y) and tint multiplies the rgb channels
+    def get_sprite(self, sprite_name, scale=None, flip=None, tint=None, inverted_mask=False) -> pg.Surface: 
+        sprite = self.sprites.get(sprite_name)
+        if sprite is None: 
+            sprite = self.sprites[sprite_name] = self.sprite_sheet.subsurface(self.offsets[sprite_name])
+        if scale is None and flip is None and tint is None and not inverted_mask: 
+            return sprite
+
+        # lists and pg.Color are accepted but unhashable, so the key is built from tuples
+        scale = None if scale is None else tuple(scale)
+        flip = None if flip is None else tuple(flip)
+        tint = None if tint is None else tuple(tint)
+        key = (sprite_name, scale, flip, tint, bool(inverted_mask))
+        variant = self.variants.get(key)
+        if variant is None: 
+            variant = self.variants[key] = self.make_variant(sprite, scale, flip, tint, inverted_mask)
+        return variant
+
+    def make_variant(self, sprite: pg.Surface, scale, flip, tint, inverted_mask) -> pg.Surface: 
+        if scale is not None: 
+            sprite = pg.transform.scale(sprite, scale)
+        if flip is not None: 
+            sprite = pg.transform.flip(sprite, *flip)
+        if tint is not None: 
+            sprite = sprite.copy()
+            sprite.fill(tint, special_flags=pg.BLEND_RGB_MULT)
+
+        # silhouette of the sprite ... opaque pixels become black and the rest transparent
+        if inverted_mask: 
+            mask = pg.mask.from_surface(sprite)
+            mask.invert()
+            sprite = mask.to_surface()
+            sprite.set_colorkey((255,255,255))
+
+        return sprite
+
     def get_atlas(self): 
-        return self.sprite_sheet
\ No newline at end of file
+        return self.sprite_sheet
@@ -0,0 +1,16 @@
+from time import time
+
+class WallClock: 
+    def now(self) -> float: 
+        return time()
+
+class VirtualClock: 
+    # only moves when told to ... lets simulations run faster than real time and reproducibly
+    def __init__(self, start=0.0): 
+        self.t = start
+
+    def now(self) -> float: 
+        return self.t
+
+    def advance(self, dt): 
+        self.t += dt
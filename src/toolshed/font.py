@@ -1,3 +1,4 @@
+from collections import OrderedDict
 from dataclasses import dataclass
 from typing import List, Tuple
 
@@ -16,17 +17,29 @@ class Dialogue:
 	debug: bool = False
 
 class FontSpriteWriter: 
-	def __init__(self, sprite_sheet, sprite_w=8, sprite_h=8, highlight_color=(150,150,150)): 
+	def __init__(self, sprite_sheet, sprite_w=8, sprite_h=8, highlight_color=(150,150,150), cache_size=128, max_tints=16): 
 		self.sprite_w = sprite_w 
 		self.sprite_h = sprite_h 
 		self.highlight_color = highlight_color
 
+		# key: text, bounding size, color, shadow, underline, highlight and cursor of a render call
+		# value: text layout and the string surface rasterized from it
+		self.cache = OrderedDict()
+		self.cache_size = cache_size
+		self.cache_hits = 0
+		self.cache_misses = 0
+
 		# key: color
 		# value: font sprite sheet
+		# least recently used tints are evicted past max_tints ... pinned colors are never evicted
 		self.default_color = (255, 255, 255)
-		self.fonts = {
+		self.fonts = OrderedDict({
 			self.default_color: sprite_sheet
-		}
+		})
+		self.pinned = { self.default_color }
+		self.max_tints = max_tints
+		self.tints_created = 0
+		self.tints_evicted = 0
 		
 		self.font_offset = {}
 		for i in range(10): 
@@ -66,51 +79,116 @@ class FontSpriteWriter:
 		return (len(text) * self.sprite_w, self.sprite_h)
 	
 	def get_font_mapped_from_color(self, color) -> pg.Surface: 
-		if color in self.fonts: 
-			return self.fonts[color]
+		color = tuple(color)
+		font = self.fonts.get(color)
+		if font is not None: 
+			self.fonts.move_to_end(color)
+			return font
 		
-		new_color_font = self.fonts[(255,255,255)].copy()
+		new_color_font = self.fonts[self.default_color].copy()
 		new_color_font.fill(color, special_flags=pg.BLEND_RGB_MULT)
 		self.fonts[color] = new_color_font
-		print(f'[ DEBUG ] Created new font tint for {color}')
+		self.tints_created += 1
+
+		# evict the least recently used tint that isn't pinned
+		if len(self.fonts) - len(self.pinned) > self.max_tints: 
+			for key in self.fonts: 
+				if key not in self.pinned: 
+					del self.fonts[key]
+					self.tints_evicted += 1
+					break 
+
 		return new_color_font
 
-	def render(self, surf: pg.Surface, dialogue: Dialogue, color: Tuple[int] | None = None) -> List[List[int]]: 
-		# tint font and store in dictionary if not created yet
-		font = self.get_font_mapped_from_color(color if color else self.default_color)
-		shadow_font = None 
-		if dialogue.shadow_color: 
-			shadow_font = self.get_font_mapped_from_color(dialogue.shadow_color)
+	def prebake(self, palette): 
+		# tint a known palette up front so the first use doesn't happen mid-frame
+		for color in palette: 
+			color = tuple(color)
+			self.get_font_mapped_from_color(color)
+			self.pinned.add(color)
 
-		rect = dialogue.bounding_box
-		pos = (rect[0], rect[1])
-		dim = (rect[2], rect[3])
-		cols, rows = dim[0] // self.sprite_w, dim[1] // self.sprite_h
+	def get_tint_memory(self) -> int: 
+		# bytes held by tinted copies of the sprite sheet, excluding the original
+		return sum(
+			font.get_pitch() * font.get_height() 
+			for color, font in self.fonts.items() if color != self.default_color
+		)
 
-		if shadow_font: 
-			dim = (dim[0]+1, dim[1]+1)
+	def clear_cache(self): 
+		self.cache.clear()
+		self.cache_hits = 0
+		self.cache_misses = 0
+
+	def render(self, surf: pg.Surface, dialogue: Dialogue, color: Tuple[int] | None = None) -> List[List[int]]: 
+		color = color if color else self.default_color
+		rect = dialogue.bounding_box
 
-		# render grid holds the char idx that is (or should be) rendered in that position
-		# getting location of rendered char is non-trival because of word wrapping
-		render_grid = [[len(dialogue.text) for _ in range(cols+1)] for i in range(rows)]
+		highlight = None
+		if dialogue.highlight_start is not None and dialogue.highlight_end is not None: 
+			highlight = (dialogue.highlight_start, dialogue.highlight_end)
 
-		highlighting: bool = (
-			dialogue.highlight_start is not None and dialogue.highlight_end is not None
+		# most strings are identical frame to frame so reuse the last render when possible
+		key = (
+			dialogue.text, rect[2], rect[3], color, dialogue.shadow_color, 
+			dialogue.underline, highlight, dialogue.cursor_idx
 		)
+		entry = self.cache.get(key)
+		if entry is None: 
+			self.cache_misses += 1
+			layout = self.layout(dialogue.text, (rect[2], rect[3]))
+			entry = (layout, self.rasterize(layout, color, dialogue.shadow_color, highlight))
+			if self.cache_size > 0: 
+				self.cache[key] = entry
+				if len(self.cache) > self.cache_size: 
+					self.cache.popitem(last=False)
+		else: 
+			self.cache_hits += 1
+			self.cache.move_to_end(key)
 
-		# create a variable length surface to contain the entire string
-		string_surf = pg.Surface(dim)
-		string_surf.set_colorkey((255,0,255))
-		string_surf.fill((255, 0, 255))
-		
-		i, j = 0, 0
-		word_start_idx = None
-		for idx, character in enumerate(dialogue.text): 
-			# found start of new word ... check if it needs to be wrapped
-			if word_start_idx is None: 
-				word_end_idx = dialogue.text.find(' ', idx) 
+		layout, string_surf = entry
+		self.draw_layout(surf, dialogue, layout, string_surf)
+		return layout.render_grid
+
+	def layout(self, text: str, size: Tuple[int, int], prev: 'TextLayout | None' = None, edit_idx: int | None = None) -> 'TextLayout': 
+		cols, rows = size[0] // self.sprite_w, size[1] // self.sprite_h
+
+		# an edit can only change rows from the one holding the edited word ... 
+		# start a row earlier since a shorter word may now fit on the previous line
+		start_row = 0
+		if prev is not None and edit_idx is not None and prev.cols == cols and prev.rows == rows: 
+			word_start_idx = text.rfind(' ', 0, edit_idx) + 1
+			start_row = max(prev.get_row(word_start_idx) - 1, 0)
+
+		if start_row > 0: 
+			# keep rows before the restart, swapping the old end-of-text marker for the new one
+			old_len = len(prev.text)
+			render_grid = [
+				[len(text) if idx == old_len else idx for idx in row] 
+				for row in prev.render_grid[:start_row]
+			]
+			render_grid += [[len(text) for _ in range(cols+1)] for i in range(rows-start_row)]
+			glyphs = [glyph for glyph in prev.glyphs if glyph[2] < start_row]
+			skipped = { idx: i for idx, i in prev.skipped.items() if i < start_row }
+			line_starts = prev.line_starts[:start_row+1]
+		else: 
+			# render grid holds the char idx that is (or should be) rendered in that position
+			# getting location of rendered char is non-trival because of word wrapping
+			render_grid = [[len(text) for _ in range(cols+1)] for i in range(rows)]
+			glyphs = []
+			skipped = {}
+			line_starts = [(0, False)]
+
+		start_idx, start_wrapped = line_starts[start_row]
+		i, j = start_row, 0
+		for idx in range(start_idx, len(text)): 
+			character = text[idx]
+
+			# check if the word starting here needs to be wrapped ... 
+			# a char that was just wrapped onto this row is not checked again
+			if not (start_wrapped and idx == start_idx): 
+				word_end_idx = text.find(' ', idx) 
 				if word_end_idx == -1: 
-					word_end_idx = len(dialogue.text)
+					word_end_idx = len(text)
 
 				# wrap to next line
 				if word_end_idx-idx + j > cols and i+1 < rows: 
@@ -118,13 +196,11 @@ class FontSpriteWriter:
 						render_grid[i][j+k] = idx
 					i += 1
 					j = 0
+					line_starts.append((idx, True))
 
+			# spaces at the start of a line are not drawn
 			if j == 0 and character == ' ': 
-				# render cursor on previous line
-				if dialogue.cursor_idx == idx: 
-					cursor_pos = (pos[0] + cols*self.sprite_w-1, pos[1] + (i-1)*self.sprite_h)
-					pg.draw.line(surf, (0,0,0), cursor_pos, (cursor_pos[0], cursor_pos[1] + self.sprite_h))
-				
+				skipped[idx] = i
 				if i != 0: 
 					render_grid[i-1][cols] = idx
 				continue 
@@ -133,29 +209,77 @@ class FontSpriteWriter:
 				# record char idx in render grid
 				render_grid[i][j] = idx
 			except: 
-				print(f'[ ERROR ] Failed to entire text in grid: {dialogue.text}')
+				print(f'[ ERROR ] Failed to entire text in grid: {text}')
 
-			if character.isspace(): 
-				word_start_idx = None
+			glyphs.append((idx, j, i))
+
+			# increment column for next character
+			j += 1
+			if j >= cols: 
+				if i == rows-1: 
+					break 
+				i += 1
+				j = 0
+				line_starts.append((idx+1, False))
+
+		# copy last row of render_grid for highlighting updates
+		if i != rows-1: 
+			for k in range(1, rows-i): 
+				render_grid[i+k] = render_grid[i]
+
+		return TextLayout(
+			text=text, 
+			size=(size[0], size[1]), 
+			cols=cols, 
+			rows=rows, 
+			glyphs=glyphs, 
+			render_grid=render_grid, 
+			line_starts=line_starts, 
+			skipped=skipped, 
+			end=(j, i), 
+			dirty_row=start_row
+		)
+
+	def rasterize(self, layout: 'TextLayout', color: Tuple[int] | None = None, shadow_color: Tuple[int] | None = None, highlight: Tuple[int, int] | None = None, string_surf: pg.Surface | None = None, from_row: int = 0) -> pg.Surface: 
+		# tint font and store in dictionary if not created yet
+		font = self.get_font_mapped_from_color(color if color else self.default_color)
+		shadow_font = None 
+		if shadow_color: 
+			shadow_font = self.get_font_mapped_from_color(shadow_color)
+
+		dim = layout.size
+		if shadow_font: 
+			dim = (dim[0]+1, dim[1]+1)
+
+		# only redraw the rows from from_row onwards of an existing surface ... 
+		# shadows bleed into the row below so those always start from scratch
+		if string_surf is None or shadow_font or string_surf.get_size() != dim: 
+			from_row = 0
+
+		# create a variable length surface to contain the entire string
+		if from_row == 0: 
+			string_surf = pg.Surface(dim)
+			string_surf.set_colorkey((255,0,255))
+		string_surf.fill((255, 0, 255), pg.Rect(0, from_row*self.sprite_h, dim[0], dim[1]))
+
+		for idx, j, i in layout.glyphs: 
+			if i < from_row: 
+				continue 
 
 			# shift lowercase letters to upper case
+			character = layout.text[idx]
 			if 'a' <= character <= 'z': 
 				character = chr(ord(character)-32) 
 
 			# draw background highlight
-			if highlighting: 
-				if dialogue.highlight_start <= idx < dialogue.highlight_end:
+			if highlight is not None: 
+				if highlight[0] <= idx < highlight[1]:
 					pg.draw.rect(
 						string_surf, 
 						self.highlight_color, 
 						pg.Rect(j*self.sprite_w, i*self.sprite_h, self.sprite_w, self.sprite_h)
 					)
 
-			# draw cursor
-			if dialogue.cursor_idx == idx: 
-				cursor_pos = (pos[0] + j*self.sprite_w-1, pos[1] + i*self.sprite_h)
-				pg.draw.line(surf, (0,0,0), cursor_pos, (cursor_pos[0], cursor_pos[1] + self.sprite_h))
-
 			# self.font maps character to the offset in the sprite sheet
 			area = (self.font_offset[character][0], self.font_offset[character][1], self.sprite_w, self.sprite_h)
 
@@ -174,24 +298,20 @@ class FontSpriteWriter:
 				area=area
 			)
 
-			# increment column for next character
-			j += 1
-			if j >= cols: 
-				if i == rows-1: 
-					break 
-				i += 1
-				j = 0
+		return string_surf
 
-		# draw cursor at end of last char if not already drawn
-		if dialogue.cursor_idx == len(dialogue.text): 
-			cursor_pos = (pos[0] + j*self.sprite_w-1, pos[1] + i*self.sprite_h)
-			pg.draw.line(surf, (0,0,0), cursor_pos, (cursor_pos[0], cursor_pos[1] + self.sprite_h))
+	def draw_layout(self, surf: pg.Surface, dialogue: Dialogue, layout: 'TextLayout', string_surf: pg.Surface): 
+		rect = dialogue.bounding_box
+		pos = (rect[0], rect[1])
+		dim = string_surf.get_size()
+
+		# cursor is drawn straight to the target surface underneath the text
+		if dialogue.cursor_idx is not None: 
+			offset = layout.get_cursor_offset(dialogue.cursor_idx, self.sprite_w, self.sprite_h)
+			if offset is not None: 
+				cursor_pos = (pos[0] + offset[0], pos[1] + offset[1])
+				pg.draw.line(surf, (0,0,0), cursor_pos, (cursor_pos[0], cursor_pos[1] + self.sprite_h))
 
-		# copy last row of render_grid for highlighting updates
-		if i != rows-1: 
-			for k in range(1, rows-i): 
-				render_grid[i+k] = render_grid[i]
-			
 		# draw outline of bounding box
 		if dialogue.debug: 
 			pg.draw.rect(surf,(255,0,0), (pos[0], pos[1], dim[0]-1, dim[1]-1), width=1)
@@ -200,10 +320,54 @@ class FontSpriteWriter:
 		surf.blit(string_surf, dest=pos)
 
 		if dialogue.underline: 
-			y_offset = 0 if shadow_font is None else -1
+			y_offset = 0 if not dialogue.shadow_color else -1
 			dim = ( min(len(dialogue.text)*self.sprite_w, dim[0]), dim[1] + y_offset )
 			start = (pos[0] - 2, pos[1] + dim[1] + 2)
 			end = (pos[0] + dim[0] + 1, pos[1] + dim[1] + 2)
 			pg.draw.line(surf, dialogue.shadow_color if dialogue.shadow_color else self.default_color, start, end, width=1)
 
-		return render_grid
+@dataclass
+class TextLayout: 
+	text: str
+	size: Tuple[int, int]
+	cols: int
+	rows: int
+
+	# (char idx, col, row) of every glyph that is drawn
+	glyphs: List[Tuple[int, int, int]]
+	render_grid: List[List[int]]
+
+	# (char idx, started by word wrap) for each row that text reached
+	line_starts: List[Tuple[int, bool]]
+
+	# key: idx of a space skipped at the start of a line
+	# value: row it was skipped on
+	skipped: dict
+
+	# (col, row) after the last glyph
+	end: Tuple[int, int]
+
+	# first row that differs from the layout this was built from
+	dirty_row: int = 0
+
+	def get_row(self, idx): 
+		row = 0
+		for i, (start_idx, _) in enumerate(self.line_starts): 
+			if start_idx > idx: 
+				break 
+			row = i
+		return row
+
+	def get_cursor_offset(self, cursor_idx, sprite_w, sprite_h) -> Tuple[int, int] | None: 
+		# cursor on a skipped space is shown at the end of the previous line
+		if cursor_idx in self.skipped: 
+			return (self.cols*sprite_w-1, (self.skipped[cursor_idx]-1)*sprite_h)
+
+		if cursor_idx == len(self.text): 
+			j, i = self.end
+			return (j*sprite_w-1, i*sprite_h)
+
+		for idx, j, i in self.glyphs: 
+			if idx == cursor_idx: 
+				return (j*sprite_w-1, i*sprite_h)
+		return None
@@ -1,28 +1,143 @@
+import atexit
+import json
 import os
+import sys
+from time import time
+
+class FileSink: 
+    # records are written from a background thread so the frame loop never waits on the disk ...
+    # where threads are unavailable (the browser build) they are buffered and written in batches
+    def __init__(self, path, level, json_lines=False, batch_size=64): 
+        self.path = path
+        self.level = level
+        self.json_lines = json_lines
+        self.batch_size = batch_size
+        self.file = open(path, 'a')
+
+        self.buffer = []
+        self.queue = None
+        if sys.platform != 'emscripten': 
+            import queue
+            import threading
+            self.queue = queue.Queue()
+            threading.Thread(target=self.drain, name='toolshed-log-sink', daemon=True).start()
+
+    def format(self, record) -> str: 
+        t, level_name, message = record
+        if self.json_lines: 
+            return json.dumps({ 't': round(t, 4), 'level': level_name, 'msg': message }) + '\n'
+        return f'{t:.4f} [ {level_name} ] {message}\n'
+
+    def write(self, record): 
+        if self.file.closed: 
+            return
+        if self.queue is not None: 
+            self.queue.put(record)
+            return
+
+        self.buffer.append(record)
+        if len(self.buffer) >= self.batch_size: 
+            self.flush()
+
+    def drain(self): 
+        while True: 
+            # pick up everything already waiting so the file is written in batches
+            records = [ self.queue.get() ]
+            while len(records) < self.batch_size and not self.queue.empty(): 
+                records.append(self.queue.get_nowait())
+
+            self.file.write(''.join(self.format(record) for record in records if record is not None))
+            self.file.flush()
+            for _ in records: 
+                self.queue.task_done()
+            if None in records: 
+                return
+
+    def flush(self): 
+        if self.queue is not None: 
+            self.queue.join()
+            return
+
+        if len(self.buffer) > 0: 
+            self.file.write(''.join(self.format(record) for record in self.buffer))
+            self.file.flush()
+            self.buffer = []
+
+    def close(self): 
+        if self.file.closed: 
+            return
+        if self.queue is not None: 
+            self.queue.put(None)
+        self.flush()
+        self.file.close()
 
 class Logger: 
     class Level: 
-        DEBUG = 'DEBUG'
-        INFO = 'INFO'
-        ERROR = 'ERROR'
+        DEBUG = 10
+        INFO = 20
+        ERROR = 40
+
+        NAMES = { DEBUG: 'DEBUG', INFO: 'INFO', ERROR: 'ERROR' }
+
+        @classmethod
+        def from_name(cls, name): 
+            for level, level_name in cls.NAMES.items(): 
+                if level_name == name.upper(): 
+                    return level
+            raise ValueError(f'Unknown log level: {name}')
 
     def __init__(self): 
         env = os.environ
         self.root = None
+        self.sinks = []
+
+        # printing is slow in the browser so only info and above reach its console by default
+        default_level = 'INFO' if sys.platform == 'emscripten' else 'DEBUG'
+        self.console_level = self.Level.from_name(env.get('PYGAME_TOOLSHED_LOG_LEVEL', default_level))
+
+        # messages below this are dropped before any formatting happens
+        self.level = self.console_level
+
         if 'PYGAME_TOOLSHED_LOGGER_ROOT' in env.keys(): 
             self.root = env.get('PYGAME_TOOLSHED_LOGGER_ROOT')
-            self.debug(f'Logger initialized with root: {self.root}')
+            self.debug('Logger initialized with root: %s', self.root)
+
+        if 'PYGAME_TOOLSHED_LOG_FILE' in env.keys(): 
+            self.add_file_sink(
+                env.get('PYGAME_TOOLSHED_LOG_FILE'),
+                json_lines=env.get('PYGAME_TOOLSHED_LOG_JSON', '0') == '1'
+            )
+
+    def add_file_sink(self, path, level=Level.DEBUG, json_lines=False) -> FileSink: 
+        sink = FileSink(path, level, json_lines)
+        self.sinks.append(sink)
+        self.level = min(self.level, level)
+        atexit.register(sink.close)
+        return sink
+
+    def set_console_level(self, level): 
+        self.console_level = level
+        self.level = min([level] + [sink.level for sink in self.sinks])
+
+    def is_enabled(self, level): 
+        return level >= self.level
 
     def prefix(self, level): 
-        return f'[ {level} ] '
+        return f'[ {self.Level.NAMES[level]} ] '
 
-    def debug(self, message): 
-        self.log(self.Level.DEBUG, message)  
+    def debug(self, message, *args): 
+        if self.Level.DEBUG >= self.level: 
+            self.log(self.Level.DEBUG, message, args)
 
-    def info(self, message): 
-        self.log(self.Level.INFO, message)  
+    def info(self, message, *args): 
+        if self.Level.INFO >= self.level: 
+            self.log(self.Level.INFO, message, args)
 
-    def error(self, message, ex: Exception = None): 
+    def error(self, message, *args, ex: Exception = None): 
+        if self.Level.ERROR < self.level: 
+            return
+        if args: 
+            message = message % args
         if ex is not None: 
             message += f': {ex}\n'
             frame = ex.__traceback__
@@ -33,10 +148,28 @@ class Logger:
                 message += f'Line: {frame.tb_lineno} -- {frame.tb_frame.f_code.co_name}() -- {filename}\n'
                 frame = frame.tb_next
             message = message[:-1]
-        self.log(self.Level.ERROR, message) 
+        self.log(self.Level.ERROR, message)
+
+    def log(self, level, input_msg, args=()): 
+        if level < self.level: 
+            return
+        message = input_msg % args if args else input_msg
+
+        if level >= self.console_level: 
+            prefix = self.prefix(level)
+            if '\n' in message: 
+                whitespace_prefix = '\n' + ' ' * len(prefix)
+                message_lines = whitespace_prefix.join(message.split('\n'))
+                print(f'{prefix}{message_lines}')
+            else: 
+                print(f'{prefix}{message}')
+
+        if len(self.sinks) > 0: 
+            record = (time(), self.Level.NAMES[level], message)
+            for sink in self.sinks: 
+                if level >= sink.level: 
+                    sink.write(record)
 
-    def log(self, level, input_msg): 
-        prefix = self.prefix(level)
-        whitespace_prefix = '\n' + ''.join([' ' for i in range(len(prefix))])
-        constructed_msg = whitespace_prefix.join(input_msg.split('\n'))
-        print(f'{prefix}{constructed_msg}')
+    def flush(self): 
+        for sink in self.sinks: 
+            sink.flush()
@@ -6,7 +6,6 @@ import pygame as pg
 from . import get_logger
 from .window import PygameContext
 from .particles import ParticleManager, PulseParticle
-from .vector import Vector
 
 logger = get_logger()
 
@@ -32,10 +31,10 @@ class Mouse:
     def pos(self): 
         return self.x, self.y
 
-    def draw(self, surf): 
+    def draw(self, surf) -> pg.Rect: 
         if self.pressed: 
             pg.draw.circle(surf, self.fill_color, self.pos(), self.rad)
-        pg.draw.circle(surf, self.outline_color, self.pos(), self.rad, self.weight)
+        return pg.draw.circle(surf, self.outline_color, self.pos(), self.rad, self.weight)
 
     def update(self, mpos): 
         self.x, self.y = mpos
@@ -62,14 +61,31 @@ class Mouse:
 
         if make_particle and pm is not None: 
             pm.add_particle(
-                PulseParticle(
-                    Vector(self.x, self.y), 
-                    Vector(0,0), 
+                pm.make_particle(
+                    PulseParticle, 
+                    (self.x, self.y), 
+                    (0,0), 
                     self.particle_timer, 
                     color=self.particles_color, 
                     rad = rad
                 )
             )
 
+    def handle_motion(self, positions, pm: ParticleManager | None = None): 
+        # one frame's worth of coalesced motion events ... a trail particle is left at each position
+        if not self.trail_particles or pm is None: 
+            return 
+        for pos in positions: 
+            pm.add_particle(
+                pm.make_particle(
+                    PulseParticle, 
+                    pos, 
+                    (0,0), 
+                    self.particle_timer, 
+                    color=self.particles_color, 
+                    rad = self.rad * 0.5
+                )
+            )
+
 def toggle_mouse_trail(mouse: Mouse): 
     mouse.trail_particles = not mouse.trail_particles 
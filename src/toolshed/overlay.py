@@ -0,0 +1,64 @@
+import pygame as pg
+
+from .font import FontSpriteWriter, Dialogue
+
+class DebugOverlay: 
+    # values are stored raw or as callables and only turned into text while the overlay is shown
+    def __init__(self, refresh_every=15): 
+        self.refresh_every = refresh_every
+        self.enabled = False
+
+        # key -> (value or callable, format spec)
+        self.entries = {}
+
+        self.surf = None
+        self.frames_since_refresh = 0
+
+    def __setitem__(self, key, value): 
+        self.entries[key] = (value, '')
+
+    def __contains__(self, key): 
+        return key in self.entries
+
+    def watch(self, key, source, fmt=''): 
+        # source is called each time the overlay refreshes
+        self.entries[key] = (source, fmt)
+
+    def remove(self, key): 
+        self.entries.pop(key, None)
+
+    def toggle(self): 
+        self.enabled = not self.enabled
+        self.surf = None
+
+    def get_lines(self): 
+        lines = []
+        for key, (source, fmt) in self.entries.items(): 
+            value = source() if callable(source) else source
+            lines.append(str(key) if value is None else f'{key}: {format(value, fmt)}')
+        return lines
+
+    def refresh(self, fsr: FontSpriteWriter, color): 
+        lines = self.get_lines()
+        w, h = fsr.sprite_w, fsr.sprite_h
+        size = (max((len(s) for s in lines), default=0) * w, len(lines) * (h + 1))
+        if self.surf is None or self.surf.get_size() != size: 
+            self.surf = pg.Surface(size, pg.SRCALPHA)
+        self.surf.fill((0, 0, 0, 0))
+
+        for i, s in enumerate(lines): 
+            fsr.render(self.surf, Dialogue(s, pg.Rect(0, (h+1)*i, len(s)*w, h)), color)
+        self.frames_since_refresh = 0
+
+    # anchor is any pg.Rect position keyword (topleft, bottomleft, ...) ... defaults to the top left corner
+    def draw(self, surf: pg.Surface, fsr: FontSpriteWriter, color=(0,0,0), **anchor) -> pg.Rect | None: 
+        if not self.enabled: 
+            return None
+
+        if self.surf is None or self.frames_since_refresh >= self.refresh_every: 
+            self.refresh(fsr, color)
+        self.frames_since_refresh += 1
+
+        rect = self.surf.get_rect(**(anchor or { 'topleft': (1, 0) }))
+        surf.blit(self.surf, rect)
+        return rect
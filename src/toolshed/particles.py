@@ -1,30 +1,273 @@
-from typing import Tuple
-from dataclasses import dataclass
+from bisect import bisect_right
+from itertools import repeat
+from operator import add, mul, sub, attrgetter
+from typing import List, Tuple
+from dataclasses import dataclass, fields, MISSING
 
 import pygame as pg 
 
 from .vector import Vector
 
 class ParticleManager: 
-    def __init__(self): 
-        self.particles = []
+    class Kind: 
+        RECT = 0
+        CIRC = 1
+        CIRC_GRAVITY = 2
+        PULSE = 3
+        ELLIPSE = 4
+
+    # structure of arrays ... each kind keeps one list per attribute it uses, indexed by particle
+    # positions and velocities are complex numbers (x + yj) so one operation moves both axes
+    BASE_COLUMNS = ('death', 'pos', 'vel', 'dampening', 'color')
+    KIND_COLUMNS = {
+        Kind.RECT: ('stamp', 'corner'), 
+        Kind.CIRC: ('stamp', 'corner'), 
+        Kind.CIRC_GRAVITY: ('gravity', 'stamp', 'corner'), 
+        Kind.PULSE: ('rad', 'rad_inc'), 
+        Kind.ELLIPSE: ('w', 'h', 'w_inc', 'h_inc'), 
+    }
+
+    # pre-rendered particle shapes are dropped all at once past this many ... growing ellipses make a new one every frame
+    MAX_STAMPS = 512
+
+    def __init__(self, pooled=False): 
+        # when pooled, particles handed to the manager are recycled once consumed or dead
+        self.pool = ParticlePool() if pooled else None
+
+        # key: (kind, w, h, color)
+        # value: the particle drawn on a colorkeyed surface of that size
+        self.stamps = {}
+        self.clear()
+
+    def __len__(self): 
+        return sum(len(columns['death']) for columns in self.columns.values()) + len(self.particles)
+
+    def make_particle(self, cls, pos, vel, timer, **kwargs): 
+        if self.pool is not None: 
+            return self.pool.acquire(cls, pos, vel, timer, **kwargs)
+        return cls(Vector(*pos), Vector(*vel), timer, **kwargs)
 
     def add_particle(self, p): 
-        self.particles.append(p)
+        kind = PARTICLE_KINDS.get(type(p))
+
+        # subclasses with their own behaviour are kept as objects and updated one by one
+        if kind is None: 
+            self.particles.append(p)
+            return 
+
+        # the object only carries values into the columns ... it goes back to the pool either way
+        if self.pool is not None: 
+            self.pool.release(p)
+        if not p.alive: 
+            return 
+
+        rad, rad_inc, gravity, w, h, w_inc, h_inc = 0, 0, 0, 0, 0, 0, 0
+        if kind == self.Kind.RECT: 
+            w, h = p.dim.unpack()
+        elif kind == self.Kind.ELLIPSE: 
+            w, h, w_inc, h_inc = p.w, p.h, p.w_inc, p.h_inc
+        else: 
+            rad = p.rad
+            if kind == self.Kind.CIRC_GRAVITY: 
+                gravity = .1
+            elif kind == self.Kind.PULSE: 
+                rad_inc = .3
+
+        self.spawn(
+            kind, p.pos.x, p.pos.y, p.vel.x, p.vel.y, p.timer, 
+            color=p.color, dampening=p.dampening, rad=rad, rad_inc=rad_inc, 
+            gravity=gravity, w=w, h=h, w_inc=w_inc, h_inc=h_inc
+        )
+
+    # attributes the kind has no column for (see KIND_COLUMNS) are ignored
+    def spawn(self, kind, x, y, vx, vy, timer, color=(0,0,0), dampening=None, rad=0, rad_inc=0, gravity=0, w=0, h=0, w_inc=0, h_inc=0): 
+        # colors are part of the stamp key, so names and pg.Color are turned into tuples
+        color = tuple(pg.Color(color))
+        values = {
+            'pos': complex(x, y), 'vel': complex(vx, vy), 'dampening': 1 if dampening is None else dampening, 'color': color, 
+            'rad': rad, 'rad_inc': rad_inc, 'gravity': complex(0, gravity), 'w': w, 'h': h, 'w_inc': w_inc, 'h_inc': h_inc
+        }
+
+        # rects and circles never change shape, so their stamp and its offset from pos are picked once
+        if kind == self.Kind.RECT: 
+            values['stamp'] = self.get_stamp(kind, int(w), int(h), color)
+            values['corner'] = 0j
+        elif kind == self.Kind.CIRC or kind == self.Kind.CIRC_GRAVITY: 
+            r = int(rad)
+            values['stamp'] = self.get_stamp(kind, 2*r, 2*r, color)
+            values['corner'] = complex(r, r)
+
+        # columns are kept ordered by the frame each particle dies on so the dead are always a prefix ... 
+        # particles mostly spawn with similar timers so this is nearly always an append
+        columns = self.columns[kind]
+        death = self.frame + timer
+        values['death'] = death
+        idx = bisect_right(columns['death'], death)
+        if idx == len(columns['death']): 
+            for name, column in columns.items(): 
+                column.append(values[name])
+        else: 
+            for name, column in columns.items(): 
+                column.insert(idx, values[name])
+
+    def draw(self, surf, offset=None, exclude=(), want_rects=False) -> List[pg.Rect] | None: 
+        """Blit every particle from its cached stamp with one blits call per kind.
+
+        Draw order is intentionally by kind, then by the frame each particle dies on, not by 
+        spawn order. The touched areas are returned only if want_rects and no object particle 
+        was drawn, otherwise None.
+        """
+        # offset only shifts plain and gravity circles, matching the draw_pos they accepted as objects
+        shift = 0j if offset is None else complex(*offset)
+        real, imag = attrgetter('real'), attrgetter('imag')
+        Kind = self.Kind
+        rects = [] if want_rects else None
+
+        for kind, c in self.columns.items(): 
+            if kind in exclude or len(c['death']) == 0: 
+                continue 
+
+            # blits truncate positions the way the draw functions truncated centers and rects ... 
+            # a circle within its radius of the left or top edge may land a pixel over, already clipped
+            if 'stamp' in c: 
+                corners = map(sub, c['pos'], c['corner'])
+                if kind != Kind.RECT and shift: 
+                    corners = map(add, corners, repeat(shift))
+                corners = list(corners)
+                blits = zip(c['stamp'], zip(map(real, corners), map(imag, corners)))
+            elif kind == Kind.PULSE: 
+                blits = []
+                for pos, rad, color in zip(c['pos'], c['rad'], c['color']): 
+                    r = int(rad)
+                    blits.append((self.get_stamp(kind, 2*r, 2*r, color), (int(pos.real) - r, int(pos.imag) - r)))
+            else: 
+                blits = []
+                for pos, w, h, color in zip(c['pos'], c['w'], c['h'], c['color']): 
+                    blits.append((self.get_stamp(kind, int(w), int(h), color), (pos.real - w//2, pos.imag - h//2)))
+
+            if want_rects: 
+                rects.extend(surf.blits(blits))
+            else: 
+                surf.fblits(blits)
 
-    def draw(self, surf): 
         for p in self.particles: 
-            p.draw(surf)
+            if offset is None: 
+                p.draw(surf)
+            else: 
+                p.draw(surf, draw_pos=(p.pos.x + shift.real, p.pos.y + shift.imag))
+            rects = None
+
+        return rects
+
+    def get_stamp(self, kind, w, h, color) -> pg.Surface: 
+        key = (kind, w, h, color)
+        stamp = self.stamps.get(key)
+        if stamp is None: 
+            if len(self.stamps) >= self.MAX_STAMPS: 
+                self.stamps.clear()
+            stamp = self.stamps[key] = self.make_stamp(kind, w, h, color)
+        return stamp
+
+    def make_stamp(self, kind, w, h, color) -> pg.Surface: 
+        # the inverted color can never be the particle's own, so it is safe as the colorkey
+        stamp = pg.Surface((max(w, 0), max(h, 0)))
+        key = tuple(255 - channel for channel in color[:3])
+        stamp.fill(key)
+        stamp.set_colorkey(key)
+
+        if kind == self.Kind.RECT: 
+            stamp.fill(color)
+        elif kind == self.Kind.ELLIPSE: 
+            pg.draw.ellipse(stamp, color, stamp.get_rect(), 1)
+        else: 
+            width = 1 if kind == self.Kind.PULSE else 0
+            pg.draw.circle(stamp, color, (w//2, h//2), w//2, width)
+        return stamp
 
     def update(self): 
         for p in self.particles: 
             p.update() 
+            if not p.alive and self.pool is not None: 
+                self.pool.release(p)
+        self.particles = [p for p in self.particles if p.alive]
+
+        self.frame += 1
+        for c in self.columns.values(): 
+            # drop the particles whose timer ran out ... they sit at the front
+            dead = bisect_right(c['death'], self.frame)
+            if dead > 0: 
+                for column in c.values(): 
+                    del column[:dead]
+            if len(c['death']) == 0: 
+                continue 
 
-        self.particles = list(filter(lambda x: x.alive, self.particles))
+            # position moves by the velocity from before dampening and gravity are applied
+            c['pos'] = list(map(add, c['pos'], c['vel']))
+            c['vel'] = list(map(mul, c['vel'], c['dampening']))
+            if 'gravity' in c: 
+                c['vel'] = list(map(add, c['vel'], c['gravity']))
+            if 'rad_inc' in c: 
+                c['rad'] = list(map(add, c['rad'], c['rad_inc']))
+            if 'w_inc' in c: 
+                c['w'] = list(map(add, c['w'], c['w_inc']))
+                c['h'] = list(map(add, c['h'], c['h_inc']))
 
     def clear(self): 
+        # frames stepped by update ... particle timers are stored as the frame they die on
+        self.frame = 0
+        self.columns = {
+            kind: { name: [] for name in self.BASE_COLUMNS + names } 
+            for kind, names in self.KIND_COLUMNS.items()
+        }
         self.particles = []
 
+class ParticlePool: 
+    def __init__(self): 
+        # key: particle class
+        # value: released particles of that class ready to be reused
+        self.free = {}
+        self.defaults = {}
+        self.created = 0
+        self.reused = 0
+
+    def get_defaults(self, cls): 
+        defaults = self.defaults.get(cls)
+        if defaults is None: 
+            defaults = {
+                f.name: f.default for f in fields(cls) 
+                if f.default is not MISSING and f.name not in ('pos', 'vel', 'timer')
+            }
+            self.defaults[cls] = defaults
+        return defaults
+
+    def acquire(self, cls, pos, vel, timer, **kwargs): 
+        free = self.free.get(cls)
+        if not free: 
+            self.created += 1
+            return cls(Vector(*pos), Vector(*vel), timer, **kwargs)
+
+        # reset the recycled particle and its vectors in place
+        p = free.pop()
+        p.pos.x, p.pos.y = pos
+        p.vel.x, p.vel.y = vel
+        p.timer = timer
+        for name, value in self.get_defaults(cls).items(): 
+            setattr(p, name, value)
+        for name, value in kwargs.items(): 
+            setattr(p, name, value)
+
+        self.reused += 1
+        return p
+
+    def release(self, p): 
+        free = self.free.get(type(p))
+        if free is None: 
+            free = self.free[type(p)] = []
+        free.append(p)
+
+    def size(self): 
+        return sum(len(free) for free in self.free.values())
+
 @dataclass
 class Particle: 
     pos: Vector 
@@ -105,4 +348,12 @@ class EllipseParticle(Particle):
         super().update()
         self.w += self.w_inc
         self.h += self.h_inc
-        
+
+# particle types the manager can store as columns ... anything else is kept as an object
+PARTICLE_KINDS = {
+    RectParticle: ParticleManager.Kind.RECT, 
+    CircParticle: ParticleManager.Kind.CIRC, 
+    CircGravityParticle: ParticleManager.Kind.CIRC_GRAVITY, 
+    PulseParticle: ParticleManager.Kind.PULSE, 
+    EllipseParticle: ParticleManager.Kind.ELLIPSE
+}
@@ -0,0 +1,157 @@
+from collections import deque
+from time import perf_counter
+
+import pygame as pg
+
+from .font import FontSpriteWriter, Dialogue
+from .varhelpers import percentile
+
+class Profiler: 
+    # one colour per phase in the overlay graph, assigned in the order phases are first seen
+    COLORS = [
+        (82, 108, 255),
+        (255, 120, 120),
+        (120, 200, 120),
+        (240, 180, 60),
+        (180, 100, 220),
+        (60, 200, 220),
+        (150, 150, 150),
+    ]
+    GRAPH_H = 40
+    GRAPH_BUDGET = 1 / 60 # seconds drawn at the top of the graph
+    STATS_EVERY = 15 # frames between recomputing percentiles for the overlay
+
+    def __init__(self, window=120, enabled=False): 
+        self.enabled = enabled
+        self.window = window
+
+        # time spent in each phase this frame ... nested phases are excluded from their parent
+        self.current = {}
+        self.stack = []
+        self.started = 0
+
+        # rolling per-phase history of the last `window` frames
+        self.history = {}
+        self.frame_times = deque(maxlen=window)
+        self.frame_start = None
+        self.frame_count = 0
+
+        # every frame is kept for the csv dump only when asked for
+        self.rows = None
+
+        self.show_overlay = False
+        self.stats = {}
+        self.overlay = None
+
+    def keep_rows(self): 
+        self.rows = []
+
+    def toggle_overlay(self): 
+        self.show_overlay = not self.show_overlay
+        self.overlay = None
+
+    def begin(self, name): 
+        if not self.enabled: 
+            return
+        now = perf_counter()
+        if len(self.stack) > 0: 
+            parent = self.stack[-1]
+            self.current[parent] = self.current.get(parent, 0) + now - self.started
+        self.stack.append(name)
+        self.started = now
+
+    def end(self): 
+        if not self.enabled: 
+            return
+        now = perf_counter()
+        name = self.stack.pop()
+        self.current[name] = self.current.get(name, 0) + now - self.started
+        self.started = now
+
+    def end_frame(self): 
+        if not self.enabled: 
+            return
+        now = perf_counter()
+        frame_time = 0 if self.frame_start is None else now - self.frame_start
+        self.frame_start = now
+        self.frame_times.append(frame_time)
+
+        for name in self.current: 
+            if name not in self.history: 
+                self.history[name] = deque([0] * len(self.frame_times), maxlen=self.window)
+        for name, times in self.history.items(): 
+            times.append(self.current.get(name, 0))
+
+        if self.rows is not None: 
+            self.rows.append((self.frame_count, frame_time, dict(self.current)))
+
+        self.current = {}
+        self.frame_count += 1
+        if self.show_overlay and self.frame_count % self.STATS_EVERY == 0: 
+            self.stats = self.get_stats()
+
+    def get_stats(self) -> dict: 
+        # phase -> (p50, p95, p99) in milliseconds over the rolling window
+        stats = {}
+        for name, times in self.history.items(): 
+            ordered = sorted(times)
+            stats[name] = tuple(percentile(ordered, p) * 1000 for p in (50, 95, 99))
+        return stats
+
+    def get_overlay_rect(self, fsr: FontSpriteWriter) -> pg.Rect: 
+        # wide enough for the graph and a row of stats
+        w = max(self.window, 20 * fsr.sprite_w)
+        return pg.Rect(1, 1, w, self.GRAPH_H + (fsr.sprite_h + 1) * (len(self.history) + 1) + 2)
+
+    def draw_overlay(self, surf: pg.Surface, fsr: FontSpriteWriter) -> pg.Rect | None: 
+        if not self.show_overlay: 
+            return None
+        if len(self.stats) == 0: 
+            self.stats = self.get_stats()
+
+        rect = self.get_overlay_rect(fsr)
+        if self.overlay is None or self.overlay.get_size() != rect.size: 
+            self.overlay = pg.Surface(rect.size)
+        overlay = self.overlay
+        overlay.fill((20, 20, 30))
+
+        # stacked bars, one column per frame ... phases in first seen order from the bottom
+        scale = self.GRAPH_H / self.GRAPH_BUDGET
+        names = list(self.history.keys())
+        columns = zip(*(self.history[name] for name in names))
+        x0 = rect.w - len(self.frame_times)
+        for x, times in enumerate(columns, x0): 
+            y = self.GRAPH_H
+            for idx, t in enumerate(times): 
+                h = t * scale
+                if h < 0.5: 
+                    continue
+                pg.draw.line(overlay, self.COLORS[idx % len(self.COLORS)], (x, y), (x, max(y - h, 0)))
+                y -= h
+        pg.draw.line(overlay, (90, 90, 90), (0, 0), (rect.w, 0))
+
+        # p50/p95/p99 per phase below the graph
+        h = fsr.sprite_h + 1
+        y = self.GRAPH_H + 2
+        for idx, name in enumerate(names): 
+            p50, p95, p99 = self.stats.get(name, (0, 0, 0))
+            s = f'{name[:6]:<6} {p50:.1f} {p95:.1f} {p99:.1f}'
+            fsr.render(overlay, Dialogue(s, pg.Rect(0, y, len(s) * fsr.sprite_w, h)), self.COLORS[idx % len(self.COLORS)])
+            y += h
+
+        total = max(self.frame_times, default=0) * 1000
+        s = f'max frame {total:.1f}ms'
+        fsr.render(overlay, Dialogue(s, pg.Rect(0, y, len(s) * fsr.sprite_w, h)), (245, 232, 255))
+
+        surf.blit(overlay, rect)
+        return rect
+
+    def dump_csv(self, path): 
+        if self.rows is None: 
+            return
+        names = list(self.history.keys())
+        with open(path, 'w') as f: 
+            f.write(','.join(['frame', 'frame_ms'] + [f'{name}_ms' for name in names]) + '\n')
+            for frame, frame_time, phases in self.rows: 
+                values = [frame_time] + [phases.get(name, 0) for name in names]
+                f.write(','.join([str(frame)] + [f'{v * 1000:.3f}' for v in values]) + '\n')
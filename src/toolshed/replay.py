@@ -0,0 +1,136 @@
+import struct
+from typing import List, Tuple
+
+from . import get_logger
+from .varhelpers import percentile
+
+logger = get_logger()
+
+class KeyState: 
+    # stands in for pg.key.get_pressed() ... indexed by key code
+    def __init__(self, pressed=()): 
+        self.pressed = frozenset(pressed)
+
+    def __getitem__(self, key): 
+        return key in self.pressed
+
+class InputLog: 
+    class Kind: 
+        KeyDown = 0
+        MouseButtonUp = 1
+        MouseMotion = 2
+
+    MAGIC = b'TSIL'
+    VERSION = 1
+
+    # magic, version, seed, tick rate, number of tracked keys ... followed by the key codes
+    HEADER = struct.Struct('<4sBIHB')
+    KEY = struct.Struct('<I')
+
+    # every step is one byte of held keys, the top bit flags that events follow
+    EVENTS_FLAG = 0x80
+    EVENT_COUNT = struct.Struct('<H')
+    EVENT = struct.Struct('<BIff') # kind, key or button, x, y
+
+    def __init__(self, tracked_keys, seed, tick_rate): 
+        if len(tracked_keys) > 7: 
+            raise ValueError(f'At most 7 keys can be tracked, got {len(tracked_keys)}')
+
+        self.tracked_keys = tuple(tracked_keys)
+        self.seed = seed
+        self.tick_rate = tick_rate
+
+        # one (held key mask, events) pair per simulation step
+        self.steps: List[Tuple[int, list]] = []
+        self.pending = []
+
+    def __len__(self): 
+        return len(self.steps)
+
+    def __iter__(self): 
+        for mask, events in self.steps: 
+            yield self.get_keys(mask), events
+
+    def add_event(self, kind, code=0, pos=(0, 0)): 
+        # held until the next recorded step, which is the first one to see it
+        self.pending.append((kind, code, (pos[0], pos[1])))
+
+    def record_step(self, keys): 
+        mask = 0
+        for bit, key in enumerate(self.tracked_keys): 
+            if keys[key]: 
+                mask |= 1 << bit
+        self.steps.append((mask, self.pending))
+        self.pending = []
+
+    def get_keys(self, mask) -> KeyState: 
+        return KeyState(key for bit, key in enumerate(self.tracked_keys) if mask & (1 << bit))
+
+    def to_bytes(self) -> bytes: 
+        data = bytearray(self.HEADER.pack(self.MAGIC, self.VERSION, self.seed, self.tick_rate, len(self.tracked_keys)))
+        for key in self.tracked_keys: 
+            data += self.KEY.pack(key)
+
+        for mask, events in self.steps: 
+            if len(events) == 0: 
+                data.append(mask)
+                continue
+
+            data.append(mask | self.EVENTS_FLAG)
+            data += self.EVENT_COUNT.pack(len(events))
+            for kind, code, (x, y) in events: 
+                data += self.EVENT.pack(kind, code, x, y)
+        return bytes(data)
+
+    @classmethod
+    def from_bytes(cls, data) -> 'InputLog': 
+        magic, version, seed, tick_rate, key_count = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC or version != cls.VERSION: 
+            raise ValueError(f'Not a version {cls.VERSION} input log')
+        offset = cls.HEADER.size
+
+        tracked_keys = []
+        for _ in range(key_count): 
+            tracked_keys.append(cls.KEY.unpack_from(data, offset)[0])
+            offset += cls.KEY.size
+        log = cls(tracked_keys, seed, tick_rate)
+
+        while offset < len(data): 
+            mask = data[offset]
+            offset += 1
+
+            events = []
+            if mask & cls.EVENTS_FLAG: 
+                count, = cls.EVENT_COUNT.unpack_from(data, offset)
+                offset += cls.EVENT_COUNT.size
+                for _ in range(count): 
+                    kind, code, x, y = cls.EVENT.unpack_from(data, offset)
+                    offset += cls.EVENT.size
+                    events.append((kind, code, (x, y)))
+            log.steps.append((mask & ~cls.EVENTS_FLAG, events))
+        return log
+
+    def save(self, path): 
+        data = self.to_bytes()
+        with open(path, 'wb') as f: 
+            f.write(data)
+        logger.info('Saved %d steps of input (%d KB) to %s', len(self.steps), len(data) // 1024, path)
+
+    @classmethod
+    def load(cls, path) -> 'InputLog': 
+        with open(path, 'rb') as f: 
+            return cls.from_bytes(f.read())
+
+def get_frame_time_stats(frame_times) -> dict: 
+    # frame_times in seconds ... reported in milliseconds
+    if len(frame_times) == 0: 
+        return {}
+    ordered = sorted(frame_times)
+    return {
+        'frames': len(ordered),
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3),
+        'p50_ms': round(percentile(ordered, 50) * 1000, 3),
+        'p95_ms': round(percentile(ordered, 95) * 1000, 3),
+        'p99_ms': round(percentile(ordered, 99) * 1000, 3),
+        'max_ms': round(ordered[-1] * 1000, 3),
+    }
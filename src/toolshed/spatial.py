@@ -0,0 +1,107 @@
+from bisect import insort
+from typing import Tuple
+
+class SpatialHash: 
+    def __init__(self, cell_size, margin=0, order=None): 
+        self.cell_size = cell_size
+
+        # when given, every bucket is kept sorted by order(obj) so a single cell reads back in that order
+        self.order = order
+
+        # largest distance an object reaches past its position ... queries are grown by it
+        self.margin = margin
+
+        # key: (col, row) of cell
+        # value: list of objects positioned in that cell
+        self.buckets = {}
+        self.count = 0
+
+    def __len__(self): 
+        return self.count
+
+    def get_key(self, pos) -> Tuple[int, int]: 
+        return int(pos[0] // self.cell_size), int(pos[1] // self.cell_size)
+
+    def insert(self, obj, pos): 
+        key = self.get_key(pos)
+        bucket = self.buckets.get(key)
+        if bucket is None: 
+            bucket = self.buckets[key] = []
+        bucket.append(obj)
+        self.count += 1
+
+    def remove(self, obj, pos): 
+        key = self.get_key(pos)
+        bucket = self.buckets.get(key)
+        if bucket is None or obj not in bucket: 
+            return False
+
+        bucket.remove(obj)
+        if len(bucket) == 0: 
+            del self.buckets[key]
+        self.count -= 1
+        return True
+
+    def get_rect_keys(self, rect): 
+        x, y, w, h = rect
+        start_j, start_i = self.get_key((x, y))
+        end_j, end_i = self.get_key((x + max(w - 1, 0), y + max(h - 1, 0)))
+        for i in range(start_i, end_i + 1): 
+            for j in range(start_j, end_j + 1): 
+                yield j, i
+
+    # objects with an extent are added to every cell their rect covers
+    def insert_rect(self, obj, rect): 
+        for key in self.get_rect_keys(rect): 
+            bucket = self.buckets.get(key)
+            if bucket is None: 
+                bucket = self.buckets[key] = []
+            if self.order is None: 
+                bucket.append(obj)
+            else: 
+                insort(bucket, obj, key=self.order)
+        self.count += 1
+
+    def remove_rect(self, obj, rect): 
+        found = False
+        for key in self.get_rect_keys(rect): 
+            bucket = self.buckets.get(key)
+            if bucket is None: 
+                continue
+
+            # compare by identity ... dataclass objects with equal fields are still different objects
+            idx = next((idx for idx, other in enumerate(bucket) if other is obj), None)
+            if idx is None: 
+                continue
+            del bucket[idx]
+            found = True
+            if len(bucket) == 0: 
+                del self.buckets[key]
+
+        if found: 
+            self.count -= 1
+        return found
+
+    def query_point(self, pos) -> list: 
+        return self.buckets.get(self.get_key(pos), [])
+
+    def clear(self): 
+        self.buckets = {}
+        self.count = 0
+
+    def query(self, rect) -> list: 
+        x, y, w, h = rect
+        m = self.margin
+        start_j, start_i = self.get_key((x - m, y - m))
+        end_j, end_i = self.get_key((x + w + m, y + h + m))
+
+        found = []
+        for i in range(start_i, end_i + 1): 
+            for j in range(start_j, end_j + 1): 
+                bucket = self.buckets.get((j, i))
+                if bucket is not None: 
+                    found.extend(bucket)
+        return found
+
+    def query_radius(self, pos, radius) -> list: 
+        return self.query((pos[0] - radius, pos[1] - radius, radius * 2, radius * 2))
@@ -1,15 +1,30 @@
+from bisect import insort
 from dataclasses import dataclass, field
 from typing import List, Tuple 
 from copy import copy 
 
 import pygame as pg
 
-from .font import FontSpriteWriter, Dialogue
+from .font import FontSpriteWriter, Dialogue, TextLayout
+from .spatial import SpatialHash
+
+def set_cursor(cursor): 
+    # the dummy video driver used for headless runs has no cursor support
+    try: 
+        pg.mouse.set_cursor(cursor)
+    except pg.error: 
+        pass
 
 @dataclass
 class Color: 
     val: Tuple[int]
 
+def get_color_key(color: Color | None): 
+    return None if color is None else tuple(color.val)
+
+def get_rect_key(rect: pg.Rect | None): 
+    return None if rect is None else tuple(rect)
+
 @dataclass
 class Node: 
     tag: str  = ''
@@ -22,6 +37,9 @@ class Node:
     z_idx: int = 0
     # sound: pg.Sound | None = None
 
+    # set on insert so nodes that resize themselves can keep the ui's hit-test index current
+    ui: 'UI' = field(default=None, repr=False, compare=False)
+
     def __repr__(self): 
         s = f'Node(tag={self.tag}  bounds={self.bounds}  children=[\n'
         if len(self.children) == 0: 
@@ -34,6 +52,14 @@ class Node:
     def draw(self, surf): 
         print(f'[ WARN ] Attempted to draw node: {self}') 
 
+    # everything that changes how the node looks ... None means it is drawn straight to the frame every time
+    def get_draw_key(self): 
+        return None
+
+    # rects used by draw, moved onto the node's cached surface while it is rendered
+    def get_draw_rects(self) -> List[pg.Rect]: 
+        return [self.bounds]
+
     def hover(self): 
         if self.hoverable and not self.hovered and self.active: 
             self.hovered = True 
@@ -44,6 +70,10 @@ class Node:
             return True 
         return False
 
+    def bounds_changed(self): 
+        if self.ui is not None: 
+            self.ui.update_bounds(self)
+
     
 @dataclass
 class ImgNode(Node): 
@@ -83,6 +113,12 @@ class TextNode(Node):
         except Exception as ex: 
             print(f'Caught exception on line: {ex.__traceback__.tb_lineno}: {ex}')
 
+    def get_draw_key(self): 
+        return (
+            get_rect_key(self.bounds), self.text, self.underline, self.hovered, id(self.font_writer),
+            get_color_key(self.color), get_color_key(self.secondary_color), get_color_key(self.shadow_color)
+        )
+
 @dataclass
 class RectNode(Node): 
     width: int = 1 
@@ -105,12 +141,30 @@ class TextFieldNode(Node):
     extendable: bool = False
     align_center: bool = False
 
+    # layout is kept between frames so edits only re-rasterize the rows they touch
+    layout: TextLayout | None = None
+    string_surf: pg.Surface | None = None
+    highlight: Tuple[int, int] | None = None
+    dirty_row: int | None = 0
+
+    def relayout(self, edit_idx=None): 
+        if self.font_writer is None or self.bounds is None: 
+            return 
+
+        prev = self.layout if edit_idx is not None else None
+        self.layout = self.font_writer.layout(self.buffer, self.bounds.size, prev, edit_idx)
+        self.render_grid = self.layout.render_grid
+
+        # rows before dirty_row are unchanged and can be kept on the string surface
+        self.dirty_row = self.layout.dirty_row if self.dirty_row is None else min(self.dirty_row, self.layout.dirty_row)
+
     def draw(self, surf): 
         cursor_idx = self.cursor_idx
         if not self.focus or self.highlight_start_idx != self.highlight_end_idx:
             cursor_idx = None
 
         if self.extendable: 
+            old_bounds = tuple(self.bounds)
             if self.align_center: 
                 self.bounds.x += self.bounds.w // 2
             
@@ -120,6 +174,9 @@ class TextFieldNode(Node):
             if self.align_center: 
                 self.bounds.x -= self.bounds.w // 2
 
+            if tuple(self.bounds) != old_bounds: 
+                self.bounds_changed()
+
         dialogue = Dialogue(
             text = self.buffer, 
             bounding_box = self.bounds, 
@@ -128,17 +185,39 @@ class TextFieldNode(Node):
             highlight_end = max(self.highlight_start_idx, self.highlight_end_idx)
         )
 
-        self.render_grid = self.font_writer.render(surf, dialogue)
+        # buffer or bounds were changed from outside of update
+        if self.layout is None or self.layout.text != self.buffer or self.layout.size != tuple(self.bounds.size): 
+            self.relayout()
+            self.dirty_row = 0
+
+        highlight = (dialogue.highlight_start, dialogue.highlight_end)
+        if highlight != self.highlight: 
+            self.highlight = highlight
+            self.dirty_row = 0
+
+        if self.dirty_row is not None: 
+            self.string_surf = self.font_writer.rasterize(
+                self.layout, highlight=highlight, string_surf=self.string_surf, from_row=self.dirty_row
+            )
+            self.dirty_row = None
+
+        self.font_writer.draw_layout(surf, dialogue, self.layout, self.string_surf)
 
     def update(self, event: pg.Event): 
         if not self.focus: 
             return 
         
+        # lowest char idx touched by this event
+        edit_idx = None
+        if self.highlight_start_idx != self.highlight_end_idx: 
+            edit_idx = min(self.highlight_start_idx, self.highlight_end_idx)
+
         # insert new unicode character into buffer
         punctuation = { ' ', '.', ':', '/', '-', '[', ']' }
         if event.unicode and (event.unicode.isalnum() or event.unicode in punctuation): 
             self.remove_highlight_section()
             self.buffer = self.buffer[:self.cursor_idx] + event.unicode + self.buffer[self.cursor_idx:]
+            edit_idx = self.cursor_idx if edit_idx is None else min(edit_idx, self.cursor_idx)
             self.cursor_idx += 1
 
         # remove characters from buffer
@@ -147,6 +226,7 @@ class TextFieldNode(Node):
             if not self.remove_highlight_section():
                 self.buffer = self.buffer[:self.cursor_idx-1] + self.buffer[self.cursor_idx:]
                 self.cursor_idx = max(self.cursor_idx-1, 0)
+                edit_idx = self.cursor_idx if edit_idx is None else min(edit_idx, self.cursor_idx)
 
         # move cursor left and right
         if event.key == pg.K_LEFT: 
@@ -154,6 +234,10 @@ class TextFieldNode(Node):
         elif event.key == pg.K_RIGHT: 
             self.cursor_idx = min(self.cursor_idx+1, len(self.buffer))
 
+        # keep the render grid current for hit-testing without waiting for a draw
+        if self.layout is not None and self.layout.text != self.buffer: 
+            self.relayout(edit_idx)
+
     def remove_highlight_section(self): 
         if self.highlight_start_idx != self.highlight_end_idx:
             lower = min(self.highlight_start_idx, self.highlight_end_idx)
@@ -273,6 +357,20 @@ class CheckboxNode(Node):
     def handle_input(self): 
         self.checked = not self.checked
 
+    def get_draw_key(self): 
+        return (
+            get_rect_key(self.bounds), get_rect_key(self.checkbox_bounds), self.checked, self.hovered, id(self.font_writer),
+            None if self.dialogue is None else (self.dialogue.text, get_rect_key(self.dialogue.bounding_box)),
+            get_color_key(self.color), get_color_key(self.secondary_color), get_color_key(self.shadow_color), 
+            get_color_key(self.box_fill_color)
+        )
+
+    def get_draw_rects(self) -> List[pg.Rect]: 
+        rects = [self.bounds, self.checkbox_bounds]
+        if self.dialogue is not None: 
+            rects.append(self.dialogue.bounding_box)
+        return rects
+
 @dataclass
 class SingleChoiceNode(Node): 
     nodes: List[Node] = None
@@ -307,6 +405,18 @@ class SingleChoiceNode(Node):
             node.checked = False 
         checkbox_node.checked = True
 
+    def get_draw_key(self): 
+        keys = [ node.get_draw_key() for node in self.nodes ]
+        if None in keys: 
+            return None
+        return (get_rect_key(self.bounds), tuple(keys))
+
+    def get_draw_rects(self) -> List[pg.Rect]: 
+        rects = [self.bounds]
+        for node in self.nodes: 
+            rects.extend(node.get_draw_rects())
+        return rects
+
 @dataclass 
 class PopoutNode(Node): 
     nodes: List[Node] = field(default_factory=list)
@@ -345,6 +455,7 @@ class PopoutNode(Node):
         self.expanded = not self.expanded
         for node in self.nodes: 
             node.active = not node.active
+        self.bounds_changed()
 
 @dataclass
 class ToolshedButtonNode(Node): 
@@ -414,14 +525,45 @@ class ToolshedButtonNode(Node):
         except Exception as ex: 
             print(f'Caught exception on line: {ex.__traceback__.tb_lineno}: {ex}')
 
+    def get_draw_key(self): 
+        return (
+            get_rect_key(self.bounds), get_rect_key(self.dialogue.bounding_box), self.text, self.hovered, id(self.font_writer),
+            get_color_key(self.primary_color), get_color_key(self.primary_shadow), 
+            get_color_key(self.secondary_color), get_color_key(self.secondary_shadow), 
+            get_color_key(self.frame_color), get_color_key(self.background_color)
+        )
+
+    def get_draw_rects(self) -> List[pg.Rect]: 
+        return [self.bounds, self.dialogue.bounding_box]
+
 class UI: 
     ROOT_TAG = 'root'
+    INDEX_CELL_SIZE = 32
+    # room around a node's rects for underlines and text shadows
+    SURFACE_MARGIN = 4
 
-    def __init__(self, font_writer: FontSpriteWriter=None, debug=False): 
+    def __init__(self, font_writer: FontSpriteWriter=None, debug=False, retained=True): 
         self.root = Node(tag=self.ROOT_TAG, bounds=None)
         self.font_writer = font_writer
         self.debug = debug
 
+        # id(node) -> (draw key, surface, position) ... nodes are only re-rendered when their draw key changes
+        self.retained = retained
+        self.surfaces = {}
+
+        # nodes are kept in descending z order, ties in insertion order ... keyed by id since nodes are unhashable
+        self.order = {}
+        self.insert_count = 0
+
+        # per parent node: spatial index of its children, plus the rect each child was indexed under
+        self.indexes = {}
+        self.indexed_bounds = {}
+        self.parents = {}
+
+        # lookups kept current on insert ... tag -> first node inserted with it, type -> nodes of it in z order
+        self.tags = {}
+        self.types = {}
+
     def __repr__(self): 
         s = f'UI(\n{self.root}\n)'
         return s 
@@ -436,54 +578,141 @@ class UI:
             )
             pg.draw.rect(surf, (255,0,0), rect, width=1)
 
+        # cached nodes are batched into one blits call, flushed before anything drawn directly
+        blits = []
         for node in reversed(self.root.children): 
             if not node.active: 
                 continue 
 
             try: 
-                node.draw(surf)
+                key = node.get_draw_key() if self.retained else None
+                if key is not None: 
+                    blits.append(self.get_surface(node, key))
+                else: 
+                    if len(blits) > 0: 
+                        surf.blits(blits, doreturn=False)
+                        blits = []
+                    node.draw(surf)
             except Exception as ex: 
                 print(f'[ ERROR ] Failed to draw node of type {node.__class__.__name__}: {ex}')
 
             if node.debug and node.bounds is not None: 
+                surf.blits(blits, doreturn=False)
+                blits = []
                 pg.draw.rect(surf, (255,0,0), node.bounds, width=1)
 
-    def insert(self, new_node: Node): 
+        if len(blits) > 0: 
+            surf.blits(blits, doreturn=False)
+
+    def get_surface(self, node: Node, key) -> Tuple[pg.Surface, Tuple[int, int]]: 
+        cached = self.surfaces.get(id(node))
+        if cached is not None and cached[0] == key: 
+            return cached[1], cached[2]
+
+        # each rect is listed once even when shared, so it is only moved once
+        rects = list({ id(rect): rect for rect in node.get_draw_rects() if rect is not None }.values())
+        margin = self.SURFACE_MARGIN
+        area = rects[0].unionall(rects[1:]).inflate(margin * 2, margin * 2)
+        node_surf = pg.Surface(area.size, pg.SRCALPHA)
+
+        # draw with the node's rects shifted onto the surface, then put them back
+        for rect in rects: 
+            rect.move_ip(-area.x, -area.y)
+        try: 
+            node.draw(node_surf)
+        finally: 
+            for rect in rects: 
+                rect.move_ip(area.x, area.y)
+
+        self.surfaces[id(node)] = (key, node_surf, area.topleft)
+        return node_surf, area.topleft
+
+    def get_order(self, node): 
+        return self.order[id(node)]
+
+    def get_index(self, parent: Node) -> SpatialHash: 
+        index = self.indexes.get(id(parent))
+        if index is None: 
+            index = self.indexes[id(parent)] = SpatialHash(self.INDEX_CELL_SIZE, order=self.get_order)
+        return index
+
+    def get_hit_bounds(self, node: Node) -> pg.Rect: 
+        # an open popout panel blocks the nodes under it so it is indexed along with the node
+        if isinstance(node, PopoutNode) and node.expanded and node.panel_bounds is not None: 
+            return node.bounds.union(node.panel_bounds)
+        return node.bounds.copy()
+
+    def insert(self, new_node: Node, parent: Node = None): 
         if isinstance(new_node, TextFieldNode) or isinstance(new_node, TextNode) or isinstance(new_node, CheckboxNode) or isinstance(new_node, ToolshedButtonNode): 
             new_node.font_writer = self.font_writer
-            
-        if self.root.bounds is None: 
-            self.root.children.append(new_node) 
-            self.root.bounds = copy(new_node.bounds)
-            return 
-        
-        # no node was found so insert at current level
-        self.root.children.append(new_node)
-        self.root.children.sort(key=lambda x: x.z_idx, reverse=True)
-        extend_bounds(self.root, new_node.bounds)
+
+        parent = self.root if parent is None else parent
+        new_node.ui = self
+        self.insert_count += 1
+        self.order[id(new_node)] = (-new_node.z_idx, self.insert_count)
+        self.parents[id(new_node)] = parent
+
+        # insert in z order rather than re-sorting every child
+        insort(parent.children, new_node, key=self.get_order)
+        self.tags.setdefault(new_node.tag, new_node)
+        for node_type in type(new_node).__mro__: 
+            if issubclass(node_type, Node): 
+                insort(self.types.setdefault(node_type, []), new_node, key=self.get_order)
+        bounds = self.get_hit_bounds(new_node)
+        self.get_index(parent).insert_rect(new_node, bounds)
+        self.indexed_bounds[id(new_node)] = bounds
+
+        if parent.bounds is None: 
+            parent.bounds = copy(new_node.bounds)
+        else: 
+            extend_bounds(parent, new_node.bounds)
+        if parent is not self.root and id(parent) in self.parents: 
+            self.update_bounds(parent)
+
+        # children attached before insertion are indexed under their new parent
+        children, new_node.children = new_node.children, []
+        for child in children: 
+            self.insert(child, new_node)
         
     def insert_recursive(self, node: Node, input: Node): 
-        pass 
+        self.insert(input, parent=node)
+
+    def update_bounds(self, node: Node): 
+        # called by nodes that resize themselves ... anything else moving a node's bounds (or popout panel) must call it
+        parent = self.parents[id(node)]
+        index = self.get_index(parent)
+        index.remove_rect(node, self.indexed_bounds[id(node)])
+        bounds = self.get_hit_bounds(node)
+        index.insert_rect(node, bounds)
+        self.indexed_bounds[id(node)] = bounds
+
+        extend_bounds(parent, node.bounds)
+        if parent is not self.root: 
+            self.update_bounds(parent)
 
     def remove(self): 
         pass 
 
     def get_node_by_tag(self, tag): 
-        nodes = list(filter(lambda x: x.tag == tag, self.root.children))
-        return None if len(nodes) == 0 else nodes[0]
+        return self.tags.get(tag)
     
+    # the returned list is the live index and must not be modified
     def get_nodes_by_type(self, node_type) -> List[Node]:
-        return list(filter(lambda x: isinstance(x, node_type), self.root.children))
+        return self.types.get(node_type, [])
 
     def get_node(self, pos): 
         return self.get_node_rec(self.root, pos)
 
     def get_node_rec(self, parent_node, pos: Tuple[float]): 
-        if not parent_node.bounds.collidepoint(pos): 
+        if parent_node.bounds is None or not parent_node.bounds.collidepoint(pos): 
             return None
         
-        # position was found to be in bounding box, loop through all nodes to find 
-        for node in parent_node.children: 
+        # only children overlapping the cell under pos are candidates ... they come back in z order
+        index = self.indexes.get(id(parent_node))
+        if index is None: 
+            return None
+        # collidepoint truncates towards zero so the cell lookup does the same
+        for node in index.query_point((int(pos[0]), int(pos[1]))): 
             if not node.active: 
                 continue 
 
@@ -491,6 +720,11 @@ class UI:
                 return None
             
             if node.bounds.collidepoint(pos): 
+                # the deepest child under pos wins
+                if len(node.children) > 0: 
+                    child = self.get_node_rec(node, pos)
+                    if child is not None: 
+                        return child
                 return node 
             
         return None
@@ -518,7 +752,13 @@ class SceneManager:
     def __init__(self): 
         self.scene_to_ui = {}
         self.current_scene = None
-        self.current_hovered: str = ''
+
+        # direct references so hover and focus changes only touch the nodes involved
+        self.hovered: Node | None = None
+        self.focused: TextFieldNode | None = None
+
+        # the os cursor is only set when it actually changes
+        self.cursor = None
 
     def insert(self, scene_name: str, ui: UI): 
         self.scene_to_ui[scene_name] = copy(ui)
@@ -531,17 +771,18 @@ class SceneManager:
         self.scene_to_ui[self.current_scene].draw(frame) 
 
     def change_scene(self, new_scene: str, mouse_pos: Tuple[float]): 
+        # clear hover state of the old scene
+        self.clear_node_state()
+
         # change scene
         self.current_scene = new_scene
-
-        # clear hover state for all nodes
-        self.clear_node_state()
+        self.focused = None
 
         # set hover on node in new scene
         if new_scene is not None:
             node = self.get_node(mouse_pos)
             if node is not None:
-                node.hover()
+                self.hover(node)
 
         # remove focus
         self.remove_focus_from_text_fields()
@@ -549,8 +790,6 @@ class SceneManager:
         # collapse popout
         self.close_popout_nodes()
 
-        self.current_hovered = ''
-
     def get_node(self, mouse_pos): 
         if self.current_scene == None: 
             return 
@@ -571,26 +810,38 @@ class SceneManager:
         return self.scene_to_ui[self.current_scene].get_node_by_tag(tag)
     
     def get_nodes_by_type(self, node_type) -> List[Node]: 
+        if self.current_scene is None: 
+            return []
         return self.scene_to_ui[self.current_scene].get_nodes_by_type(node_type)
 
     def get_current_ui(self): 
         return self.scene_to_ui[self.current_scene]
     
-    def clear_node_state(self): 
-        if self.current_scene is None or self.current_scene not in self.scene_to_ui: 
-            return
-        for node in self.scene_to_ui[self.current_scene].root.children: 
-            node.hovered = False
-            if isinstance(node, SingleChoiceNode): 
-                for child in node.nodes: 
+    def set_cursor(self, cursor): 
+        if cursor != self.cursor: 
+            self.cursor = cursor
+            set_cursor(cursor)
+
+    def clear_hovered(self): 
+        # only the hovered node can have hover state so it is the only one reset
+        if self.hovered is not None: 
+            self.hovered.hovered = False
+            if isinstance(self.hovered, SingleChoiceNode): 
+                for child in self.hovered.nodes: 
                     child.hovered = False
-        pg.mouse.set_cursor(pg.SYSTEM_CURSOR_ARROW)
+            self.hovered = None
+
+    def clear_node_state(self): 
+        self.clear_hovered()
+        self.set_cursor(pg.SYSTEM_CURSOR_ARROW)
 
     def remove_focus_from_text_fields(self, exception: str=None): 
         if self.current_scene is None or self.current_scene not in self.scene_to_ui: 
             return
+        self.focused = None
         for node in self.get_nodes_by_type(TextFieldNode): 
             if node.tag == exception: 
+                self.focused = node if node.focus else None
                 continue 
             node.focus = False 
             node.highlight_start_idx = 0 
@@ -598,8 +849,13 @@ class SceneManager:
             node.updating_highlight = False 
 
     def get_focused_text_field(self) -> TextFieldNode | None: 
+        if self.focused is not None and self.focused.focus: 
+            return self.focused
+
+        # text fields start focused so the first lookup in a scene may still have to search
         for node in self.get_nodes_by_type(TextFieldNode): 
             if node.focus: 
+                self.focused = node
                 return node 
         return None
 
@@ -614,6 +870,7 @@ class SceneManager:
         node = self.get_node_by_tag(tag)
         if node: 
             node.focus = True
+            self.focused = node
 
     def clear_text_field(self, tag) -> str: 
         node: TextFieldNode = self.get_node_by_tag(tag)
@@ -625,24 +882,19 @@ class SceneManager:
         return word
     
     def hover(self, node): 
+        # motion within the node that is already hovered changes nothing
+        if node is self.hovered: 
+            return 
+        self.clear_hovered()
+
         # check it node can have hover state
         if not node.hover(): 
+            self.set_cursor(pg.SYSTEM_CURSOR_ARROW)
             return 
+        self.hovered = node
 
         # change cursor type based on node
-        if isinstance(self, TextFieldNode): 
-            pg.mouse.set_cursor(pg.SYSTEM_CURSOR_IBEAM)
+        if isinstance(node, TextFieldNode): 
+            self.set_cursor(pg.SYSTEM_CURSOR_IBEAM)
         else: 
-            pg.mouse.set_cursor(pg.SYSTEM_CURSOR_HAND)
-
-        # update reference to the last hovered node
-        if node.tag != self.current_hovered: 
-            old_node = self.get_node_by_tag(self.current_hovered)
-            self.current_hovered = node.tag
-
-            if old_node is None: 
-                print(f'[ INFO ] Could not find reference to hovered node: {self.current_hovered}')
-                return
-            old_node.hovered = False
-            
-        
+            self.set_cursor(pg.SYSTEM_CURSOR_HAND)
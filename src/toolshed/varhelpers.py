@@ -1,3 +1,5 @@
+import math
+
 from . import get_logger
 
 logger = get_logger()
@@ -34,9 +36,20 @@ def multiply_tuple_by_int(tup, scalar, idx=None):
         return tuple([value * scalar for value in tup])
     
     if idx >= len(tup) or idx < 0: 
-        logger.error(f'Invalid args when multipying tuple by scalar: tuple={tup} scalar={scalar} idx={idx}')
+        logger.error('Invalid args when multipying tuple by scalar: tuple=%s scalar=%s idx=%s', tup, scalar, idx)
         return tup 
     
     l = list(tuple)
     l[idx] *= scalar 
-    return tuple(l)
\ No newline at end of file
+    return tuple(l)
+
+
+def lerp(a, b, t): 
+    return a + (b - a) * t
+
+def percentile(ordered, p): 
+    # nearest rank on an already sorted sequence
+    if len(ordered) == 0: 
+        return None
+    idx = clamp(math.ceil(p / 100 * len(ordered)) - 1, upper=len(ordered) - 1, lower=0)
+    return ordered[idx]
@@ -3,9 +3,10 @@ import pygame as pg
 from dataclasses import dataclass 
 from typing import Tuple
 
-from . import get_logger
+from . import get_logger, get_profiler
 
 logger = get_logger()
+profiler = get_profiler()
 
 def get_window_scale(base_size, scaled_size):
         return min(scaled_size[0] // base_size[0], scaled_size[1] // base_size[1])
@@ -15,15 +16,22 @@ class EventContext:
     mouse_pos: Tuple[float, float] = (0,0)
 
 class PygameContext: 
-    def __init__(self, base_dims, title='Toolshed Window', icon_path=None, fps=60): 
+    # past this many regions a frame is pushed as the union of all of them
+    MAX_DIRTY_RECTS = 32
+
+    # a fixed scale skips probing the monitors, which fails on hosts without a display
+    def __init__(self, base_dims, title='Toolshed Window', icon_path=None, fps=60, dirty_rects=False, scale=None): 
         pg.init()
 
         # record the base dimensions as separate vars 
         self.base_dims = base_dims
 
         # get monitor info and record the scale and screen dimensions
-        logger.debug(f'UNAME: {os.uname().sysname}')
-        if os.uname().sysname.startswith('Emscripten'): 
+        logger.debug('UNAME: %s', os.uname().sysname)
+        if scale is not None: 
+            self.scale = scale
+
+        elif os.uname().sysname.startswith('Emscripten'): 
             info = pg.display.Info()
             self.scale = get_window_scale(base_dims, (info.current_w * .7, info.current_h))
 
@@ -32,7 +40,7 @@ class PygameContext:
             monitors = screeninfo.get_monitors()
             target_monitor_idx = 1 if len(monitors) > 1 else 0
             target_monitor_dims = (monitors[target_monitor_idx].width, monitors[target_monitor_idx].height)
-            logger.info(f'Using monitor dimensions: {target_monitor_dims}')
+            logger.info('Using monitor dimensions: %s', target_monitor_dims)
 
             horiz = target_monitor_dims[0] - base_dims[0]
             vert  = target_monitor_dims[1] - base_dims[1]
@@ -48,9 +56,17 @@ class PygameContext:
         self.screen = pg.display.set_mode(self.scaled_dims, pg.RESIZABLE)
         pg.display.set_caption(title)
         self.frame = pg.Surface(base_dims)
+        self.init_scaled_frame()
         self.clock = pg.Clock() 
         self.fps = fps
 
+        # in dirty rect mode only regions of the base frame reported by drawing code are pushed 
+        # regions from the previous frame are pushed again so whatever moved off them is erased
+        self.dirty_rects = dirty_rects
+        self.dirty = []
+        self.prev_dirty = []
+        self.full_redraw = True
+
         if icon_path is not None: 
             try: 
                 pg.display.set_icon(pg.image.load(icon_path).convert_alpha())
@@ -60,18 +76,83 @@ class PygameContext:
     def quit(self): 
         pg.quit()
 
-    def finish_drawing_frame(self): 
-        scaled_frame = pg.transform.scale(self.frame, self.scaled_dims)
+    def mark_dirty(self, *rects): 
+        self.dirty.extend(rect for rect in rects if rect is not None)
+
+    def mark_all_dirty(self): 
+        self.full_redraw = True
+
+    def init_scaled_frame(self): 
+        # destination of the upscale is only re-created when the window changes size
         fw, fh = self.scaled_dims
         sw, sh = self.screen_dims
+        self.screen = pg.display.get_surface()
+        self.letterbox = pg.Rect((sw-fw)//2, (sh-fh)//2, fw, fh)
+
+        # scale straight into the window when pixel formats match, otherwise into a persistent buffer
+        same_format = (
+            self.screen.get_bitsize() == self.frame.get_bitsize() 
+            and self.screen.get_masks() == self.frame.get_masks()
+        )
+        self.scaled_to_screen = same_format and self.screen.get_rect().contains(self.letterbox)
+        if self.scaled_to_screen: 
+            self.scaled_frame = self.screen.subsurface(self.letterbox)
+        else: 
+            self.scaled_frame = pg.Surface(self.letterbox.size, 0, self.frame)
 
-        self.screen.fill((0,0,0))
-        self.screen.blit(scaled_frame, ((sw-fw)/2, (sh-fh)/2))
-        pg.display.update()
+        # bars around the scaled frame only need clearing after a resize
+        self.letterbox_dirty = True
+
+    def finish_drawing_frame(self): 
+        profiler.begin('present')
+        if not self.dirty_rects or self.full_redraw: 
+            if self.letterbox_dirty: 
+                self.screen.fill((0,0,0))
+                self.letterbox_dirty = False
+
+            pg.transform.scale(self.frame, self.letterbox.size, self.scaled_frame)
+            if not self.scaled_to_screen: 
+                self.screen.blit(self.scaled_frame, self.letterbox)
+            pg.display.update()
+            self.full_redraw = False
+
+        else: 
+            rects = self.dirty + self.prev_dirty
+            if len(rects) > 0: 
+                self.update_regions(rects)
+
+        self.prev_dirty = self.dirty
+        self.dirty = []
+        profiler.end()
         self.clock.tick(self.fps)
 
+    def update_regions(self, rects): 
+        frame_rect = self.frame.get_rect()
+        rects = [clipped for clipped in (pg.Rect(rect).clip(frame_rect) for rect in rects) if clipped.w > 0 and clipped.h > 0]
+        if len(rects) == 0: 
+            return 
+        if len(rects) > self.MAX_DIRTY_RECTS: 
+            rects = [rects[0].unionall(rects[1:])]
+
+        # upscale each region into its spot on the scaled frame and only hand those areas to the display
+        s = self.scale
+        updated = []
+        for rect in rects: 
+            scaled_rect = pg.Rect(rect.x * s, rect.y * s, rect.w * s, rect.h * s)
+            pg.transform.scale(self.frame.subsurface(rect), scaled_rect.size, self.scaled_frame.subsurface(scaled_rect))
+
+            screen_rect = scaled_rect.move(self.letterbox.topleft)
+            if not self.scaled_to_screen: 
+                self.screen.blit(self.scaled_frame, screen_rect, area=scaled_rect)
+            updated.append(screen_rect)
+        pg.display.update(updated)
+
     def get_scaled_mouse_pos(self): 
-        mx, my = pg.mouse.get_pos()
+        return self.scale_mouse_pos(pg.mouse.get_pos())
+
+    # maps a position in window pixels (pg.mouse.get_pos, event.pos) onto the frame
+    def scale_mouse_pos(self, pos): 
+        mx, my = pos
         sw, sh = self.screen_dims
         fw, fh = self.scaled_dims
         bufx, bufy = (sw - fw) / 2, (sh - fh) /2
@@ -88,6 +169,8 @@ class PygameContext:
         self.scale = get_window_scale(self.base_dims, (w, h))
         self.scaled_dims = (self.base_dims[0] * self.scale, self.base_dims[1] * self.scale)
         self.screen_dims = (w, h)
+        self.init_scaled_frame()
+        self.mark_all_dirty()
     
     def get_event_context(self) -> EventContext: 
         return EventContext(self.get_scaled_mouse_pos())
@@ -6,6 +6,28 @@ WIDTH, HEIGHT = 320, 320
 ROWS, COLS = 10, 10
 CELL_W = WIDTH // ROWS
 
+# terrain is pre-rendered in chunks the size of the camera view
+CHUNK_ROWS, CHUNK_COLS = ROWS, COLS
+CHUNK_CACHE_SIZE = 16
+
+# trampled snow is scaled to the player's size rounded to this many pixels
+TRAMPLED_SIZE_STEP = 2
+
+# gameplay is simulated at a fixed rate ... rendering may run slower (see run)
+SIM_HZ = 60
+SIM_DT = 1 / SIM_HZ
+MAX_SIM_STEPS_PER_FRAME = 5
+RENDER_FPS = 60
+
+# rendering drops to the low rate when the median frame of a window misses the budget by this much
+LOW_RENDER_FPS = 30
+SLOW_FRAME_WINDOW = 120
+SLOW_FRAME_BUDGET_RATIO = 1.25
+
+# toggle the debug values and frame-time overlays
+DEBUG_KEY = pg.K_F2
+PROFILER_KEY = pg.K_F3
+
 PLAYER_RAD_SNOW_INC = 0.1
 PLAYER_IFRAMES = 60
 PLAYER_SEC_TO_MELTING = 3
@@ -19,6 +41,14 @@ LORE_PADDING = 10
 
 WHITE = (252, 252, 252)
 
+# font tints used by the game and menu ... pre-baked when the app starts
+FONT_PALETTE = [
+    (3, 0, 158), 
+    (0, 0, 0), 
+    (245, 232, 255), 
+    (100, 100, 100)
+]
+
 class ASN(Enum): 
     LeftClick = auto()
     RightClick = auto()